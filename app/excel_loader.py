@@ -0,0 +1,776 @@
+"""
+Word+Excel批量替换工具 - Excel读取
+功能：以只读流式方式逐行读取工作表，直接生成字符串列
+说明：结果与pandas.read_excel(dtype=str, keep_default_na=False)一致；本模块不依赖Streamlit
+"""
+
+# ==================== 导入库 ====================
+import os
+import time
+import operator
+import threading
+from collections import defaultdict, OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Iterator, Tuple, Optional, Set, Callable, Dict, Union
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils.datetime import from_excel, from_ISO8601
+from openpyxl.xml.constants import SHEET_MAIN_NS
+
+
+# ==================== 配置和常量 ====================
+
+ROW_TAG = f"{{{SHEET_MAIN_NS}}}row"
+VALUE_TAG = f"{{{SHEET_MAIN_NS}}}v"
+INLINE_STRING_TAG = f"{{{SHEET_MAIN_NS}}}is"
+TEXT_TAG = f"{{{SHEET_MAIN_NS}}}t"
+RICH_RUN_TAG = f"{{{SHEET_MAIN_NS}}}r"
+
+# 列选择器预览的行数
+DEFAULT_PREVIEW_ROWS = 50
+
+# 解析结果缓存的内存上限（可通过环境变量调整，单位MB）
+EXCEL_CACHE_BYTES = int(os.environ.get("BATCH_REPLACER_EXCEL_CACHE_MB", "256")) * 1024 * 1024
+
+# 唯一值数量不超过行数的该比例时，按需读取的列以分类类型存储（内存与唯一值数量成正比）
+CATEGORICAL_MAX_RATIO = float(os.environ.get("BATCH_REPLACER_CATEGORICAL_RATIO", "0.5"))
+
+# 转换后的单元格类型（与openpyxl一致）
+TYPE_NUMERIC = "n"
+TYPE_STRING = "s"
+TYPE_BOOL = "b"
+TYPE_ERROR = "e"
+TYPE_DATE = "d"
+
+# 清理后DataFrame的attrs中记录逐列清理耗时的键，值为[(列名, 秒数, 是否做了转换)]
+CLEAN_TIMINGS_ATTR = "clean_timings"
+
+
+# ==================== 单元格转换 ====================
+
+def convert_header_cell(value, data_type):
+    """表头单元格转为列名（与pandas一致：空单元格为空字符串，整数值的浮点数转为整数）"""
+    if value is None:
+        return ""
+    if data_type == TYPE_ERROR:
+        return np.nan
+    if data_type == TYPE_NUMERIC:
+        integral = int(value)
+        return integral if integral == value else float(value)
+    return value
+
+
+def convert_data_cell(value, data_type):
+    """
+    数据单元格转为字符串（与pandas按dtype=str读取的结果一致）
+
+    布尔值和整数0、1暂时保留原值，由finalize_column按列统一转换。
+    """
+    if value is None:
+        return ""
+    if data_type == TYPE_NUMERIC:
+        integral = int(value)
+        if integral != value:
+            return str(float(value))
+        return integral if integral in (0, 1) else str(integral)
+    if data_type == TYPE_BOOL:
+        return value
+    if data_type == TYPE_ERROR:
+        return "nan"
+    return str(value)
+
+
+def finalize_column(column: list, spellings: Optional[Dict[bool, str]] = None) -> np.ndarray:
+    """
+    把一列转为字符串数组
+
+    pandas按值去重后再转为字符串，True与1、False与0视为同一个值，以整列中
+    先出现的写法为准，这里保持一致。
+
+    Args:
+        column: 单元格值列表
+        spellings: 整列的写法（由SheetReader.note_spellings得到），未提供时以本列表中先出现的为准
+    """
+    if any(value.__class__ is not str for value in column):
+        spelled = dict(spellings) if spellings else {}
+        for value in column:
+            if value.__class__ is not str and value not in spelled:
+                spelled[value] = str(value)
+        column = [value if value.__class__ is str else spelled[value] for value in column]
+
+    array = np.empty(len(column), dtype=object)
+    array[:] = column
+    return array
+
+
+def finalize_encoded_column(
+        codes: List[int],
+        index: Dict[object, int],
+        categorical_ratio: Optional[float] = None,
+        spellings: Optional[Dict[bool, str]] = None
+) -> Union[np.ndarray, pd.Categorical]:
+    """
+    把按值编码读取的一列转为字符串列
+
+    读取时按值编号（True与1、False与0视为同一个值，与finalize_column一致）；唯一值只转换
+    一次字符串，转换后相同的值（如数字1和文本"1"）合并为同一个编码。
+
+    Args:
+        codes: 每行的编码
+        index: 值到编码的映射（按首次出现的顺序）
+        categorical_ratio: 唯一值数量不超过行数的该比例时返回分类数据，None表示总是返回字符串数组
+        spellings: 整列中布尔值与整数0、1的写法（只读取部分行时保证与整列读取一致）
+
+    Returns:
+        分类数据或字符串数组
+    """
+    spellings = spellings or {}
+    labels = np.empty(len(index), dtype=object)
+    labels[:] = [value if value.__class__ is str else spellings.get(value, str(value)) for value in index]
+    remap, categories = pd.factorize(labels)
+    codes = remap[np.asarray(codes, dtype=np.intp)]
+
+    if categorical_ratio is not None and len(categories) <= categorical_ratio * len(codes):
+        return pd.Categorical.from_codes(codes, categories=categories)
+    return np.asarray(categories, dtype=object)[codes]
+
+
+def trim_row(values: list) -> list:
+    """去掉行尾的空单元格"""
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+def dedup_column_names(names: list) -> list:
+    """
+    处理空列名和重复列名（与pandas一致）
+
+    空列名为"Unnamed: 序号"；重复列名依次加".1"、".2"，已有列名优先保留，
+    空列名最后处理。
+    """
+    names = list(names)
+    unnamed = []
+    for i, name in enumerate(names):
+        if name == "":
+            names[i] = f"Unnamed: {i}"
+            unnamed.append(i)
+
+    counts = defaultdict(int)
+    for i in [i for i in range(len(names)) if i not in unnamed] + unnamed:
+        name = original = names[i]
+        count = counts[name]
+        while count > 0:
+            counts[original] = count + 1
+            name = f"{original}.{count}"
+            count = count + 1 if name in names else counts[name]
+        names[i] = name
+        counts[name] = count + 1
+
+    return names
+
+
+# ==================== 数据结构定义 ====================
+
+@dataclass
+class SheetOutline:
+    """工作表概况：列名、数据行数和前若干行预览（用于列选择和行范围设置）"""
+    columns: List[str]
+    row_count: int
+    preview: pd.DataFrame = field(default_factory=pd.DataFrame, repr=False)
+    # 各列（按列序号）布尔值与整数0、1在整列中首次出现的写法，如{True: "1", False: "False"}
+    spellings: Dict[int, Dict[bool, str]] = field(default_factory=dict, repr=False)
+
+    def positions(self, names) -> List[int]:
+        """列名对应的列序号（忽略不存在的列，去重并保持顺序）"""
+        index = {name: i for i, name in enumerate(self.columns)}
+        return [index[name] for name in dict.fromkeys(names) if name in index]
+
+
+def read_inline_string(element) -> str:
+    """读取单元格内联字符串（纯文本和各个格式片段的文本，不含注音）"""
+    text = []
+    for child in element:
+        if child.tag == TEXT_TAG:
+            text.append(child.text or "")
+        elif child.tag == RICH_RUN_TAG:
+            for node in child:
+                if node.tag == TEXT_TAG:
+                    text.append(node.text or "")
+    return "".join(text)
+
+
+# ==================== 流式读取 ====================
+
+class SheetReader:
+    """
+    Excel工作表流式读取器
+
+    只解析工作簿结构、共享字符串和样式（用于识别日期格式），不构建工作表模型；
+    工作表XML用lxml按行增量解析，每行处理完立即释放。单元格值的转换规则与
+    openpyxl只读模式（data_only）一致。
+    """
+
+    def __init__(self, source):
+        """
+        打开工作簿
+
+        Args:
+            source: 文件路径或二进制文件对象
+        """
+        # 以下使用openpyxl的内部接口（ExcelReader的分步读取、wb._date_formats等），
+        # 依赖requirements.txt中固定的openpyxl版本，升级时需重新验证
+        reader = ExcelReader(source, read_only=True, data_only=True, keep_links=False)
+        try:
+            reader.read_manifest()
+            reader.read_strings()
+            reader.read_workbook()
+            apply_stylesheet(reader.archive, reader.wb)
+        except Exception:
+            reader.archive.close()
+            raise
+
+        self.archive = reader.archive
+        self.shared_strings = reader.shared_strings
+        self.epoch = reader.wb.epoch
+        self.date_formats = reader.wb._date_formats
+        self.timedelta_formats = reader.wb._timedelta_formats
+        self.sheets = [
+            (sheet.name, rel.target)
+            for sheet, rel in reader.parser.find_sheets()
+            if rel.target in reader.valid_files and "chartsheet" not in rel.Type
+        ]
+        self._column_index = {}
+
+    @property
+    def sheet_names(self) -> List[str]:
+        """工作表名称列表"""
+        return [name for name, _ in self.sheets]
+
+    def close(self):
+        """关闭工作簿"""
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def column_index(self, reference: str) -> int:
+        """由单元格坐标（如"AB12"）得到列序号（从1开始）"""
+        letters = reference.rstrip("0123456789")
+        index = self._column_index.get(letters)
+        if index is None:
+            index = 0
+            for letter in letters:
+                index = index * 26 + ord(letter) - 64
+            self._column_index[letters] = index
+        return index
+
+    def parse_cell(self, element) -> Tuple[object, str]:
+        """解析单元格，返回(值, 类型)"""
+        data_type = element.get("t", TYPE_NUMERIC)
+        value = None
+
+        # 逐个访问子元素比find/findtext快得多
+        for child in element:
+            tag = child.tag
+            if tag == VALUE_TAG:
+                value = child.text
+            elif tag == INLINE_STRING_TAG and data_type == "inlineStr":
+                return read_inline_string(child), TYPE_STRING
+
+        if not value or data_type == "inlineStr":
+            return None, data_type
+
+        if data_type == TYPE_NUMERIC:
+            value = float(value) if "." in value or "E" in value or "e" in value else int(value)
+            style_id = element.get("s")
+            style_id = int(style_id) if style_id else 0
+            if style_id in self.date_formats:
+                try:
+                    return from_excel(value, self.epoch, timedelta=style_id in self.timedelta_formats), TYPE_DATE
+                except (OverflowError, ValueError):
+                    return "#VALUE!", TYPE_ERROR
+            return value, TYPE_NUMERIC
+        if data_type == TYPE_STRING:
+            return self.shared_strings[int(value)], TYPE_STRING
+        if data_type == TYPE_BOOL:
+            return bool(int(value)), TYPE_BOOL
+        if data_type == "str":
+            return value, TYPE_STRING
+        if data_type == TYPE_DATE:
+            return from_ISO8601(value), TYPE_DATE
+        return value, data_type
+
+    def cell_has_value(self, element) -> bool:
+        """单元格是否有内容（转换后不是空字符串）"""
+        for child in element:
+            tag = child.tag
+            if tag == VALUE_TAG:
+                if not child.text:
+                    return False
+                if element.get("t") == TYPE_STRING:
+                    return self.shared_strings[int(child.text)] != ""
+                return element.get("t") != "inlineStr"
+            if tag == INLINE_STRING_TAG and element.get("t") == "inlineStr":
+                return read_inline_string(child) != ""
+        return False
+
+    def note_spellings(self, row, spellings: Dict[int, Dict[bool, str]]):
+        """
+        记录行中布尔值与整数0、1在各列首次出现的写法
+
+        pandas对整列去重后再转为字符串，只读取部分行时需要按整列的写法转换；
+        只解析布尔单元格和值可能为0、1的数字单元格。
+
+        Args:
+            row: 行元素
+            spellings: 各列已记录的写法（原地更新）
+        """
+        # 列号只在需要时由最近的单元格坐标计算
+        reference = None
+        offset = 0
+        for element in row:
+            data_type = element.get("t", TYPE_NUMERIC)
+            current = element.get("r")
+            if current:
+                reference, offset = current, 0
+            else:
+                offset += 1
+            if data_type != TYPE_NUMERIC and data_type != TYPE_BOOL:
+                continue
+
+            text = None
+            for child in element:
+                if child.tag == VALUE_TAG:
+                    text = child.text
+                    break
+            if not text:
+                continue
+            if data_type == TYPE_NUMERIC and text != "0" and text != "1":
+                if not ("." in text or "E" in text or "e" in text) or float(text) not in (0, 1):
+                    continue
+
+            column = (self.column_index(reference) if reference else 0) + offset
+            spelled = spellings.get(column - 1)
+            if spelled is not None and len(spelled) == 2:
+                continue
+
+            value, data_type = self.parse_cell(element)
+            if data_type == TYPE_BOOL or data_type == TYPE_NUMERIC:
+                converted = convert_data_cell(value, data_type)
+                spellings.setdefault(column - 1, {}).setdefault(bool(converted), str(converted))
+
+    def row_extent(self, row) -> int:
+        """行中最后一个有内容的单元格所在的列号（从1开始，空行为0），通常只需检查行尾的单元格"""
+        for element in row.iterchildren(reversed=True):
+            if self.cell_has_value(element):
+                reference = element.get("r")
+                if reference:
+                    return self.column_index(reference)
+                break
+        else:
+            return 0
+
+        # 单元格没有坐标时从行首按顺序计算列号
+        extent = column = 0
+        for element in row:
+            reference = element.get("r")
+            column = self.column_index(reference) if reference else column + 1
+            if self.cell_has_value(element):
+                extent = column
+        return extent
+
+    def parse_row(self, row, positions: Optional[Set[int]] = None) -> List[Tuple[object, str]]:
+        """
+        解析一行单元格
+
+        Args:
+            row: 行元素
+            positions: 只解析这些列（从0开始），其余列按空单元格返回
+
+        Returns:
+            从第一列开始的(值, 类型)列表，缺失的单元格为(None, "n")
+        """
+        empty_cell = (None, TYPE_NUMERIC)
+        limit = max(positions) + 1 if positions else None
+        cells = []
+        column = 0
+
+        for element in row:
+            reference = element.get("r")
+            column = self.column_index(reference) if reference else column + 1
+            if positions is not None:
+                if limit is None or column > limit:
+                    break
+                if column - 1 not in positions:
+                    continue
+            if column == len(cells) + 1:
+                cells.append(self.parse_cell(element))
+                continue
+            while len(cells) < column:
+                cells.append(empty_cell)
+            cells[column - 1] = self.parse_cell(element)
+
+        return cells
+
+    def iter_row_elements(self, sheet_index: int = 0) -> Iterator:
+        """
+        逐行返回工作表的行元素（只在下一次迭代前有效），缺失的行返回None
+
+        第一个返回值对应工作表第1行。
+        """
+        _, sheet_path = self.sheets[sheet_index]
+        expected_row = 1
+        row_number = 0
+
+        with self.archive.open(sheet_path) as source:
+            for _, row in etree.iterparse(source, events=("end",), tag=ROW_TAG, huge_tree=True):
+                number = row.get("r")
+                row_number = int(float(number)) if number else row_number + 1
+
+                # 跳过的行按空行返回
+                while expected_row < row_number:
+                    expected_row += 1
+                    yield None
+
+                if expected_row == row_number:
+                    expected_row += 1
+                    yield row
+
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
+
+
+def read_sheet_columns(
+        rows: Iterator[List[Tuple[object, str]]],
+        min_width: int = 0,
+        min_rows: int = 0,
+        spellings: Optional[Dict[int, Dict[bool, str]]] = None
+) -> pd.DataFrame:
+    """
+    把逐行读取的单元格直接写入各列的字符串列表
+
+    空行先只计数，后面再出现有内容的行时才补齐，末尾的空行不会占用内存。
+
+    Args:
+        rows: 单元格行的迭代器（第一行为表头）
+        min_width: 至少的列数（只读取部分行时按整个工作表的列数补齐）
+        min_rows: 至少的行数（只读取部分行时，末尾的空行不一定是工作表末尾）
+        spellings: 各列布尔值与整数0、1在整列中的写法
+
+    Returns:
+        所有列均为字符串的DataFrame
+    """
+    header = None
+    columns: List[list] = []
+    row_count = 0
+    pending_empty = 0
+
+    for row in rows:
+        if header is None:
+            header = trim_row([convert_header_cell(value, data_type) for value, data_type in row])
+            continue
+
+        values = trim_row([convert_data_cell(value, data_type) for value, data_type in row])
+        if not values:
+            pending_empty += 1
+            continue
+
+        if pending_empty:
+            for column in columns:
+                column.extend([""] * pending_empty)
+            row_count += pending_empty
+            pending_empty = 0
+
+        while len(columns) < len(values):
+            columns.append([""] * row_count)
+
+        for column, value in zip(columns, values):
+            column.append(value)
+        for column in columns[len(values):]:
+            column.append("")
+        row_count += 1
+
+    if header is None:
+        return pd.DataFrame()
+
+    if min_rows > row_count:
+        for column in columns:
+            column.extend([""] * (min_rows - row_count))
+        row_count = min_rows
+
+    width = max(min_width, len(header), len(columns))
+    header = header + [""] * (width - len(header))
+    while len(columns) < width:
+        columns.append([""] * row_count)
+
+    spellings = spellings or {}
+    df = pd.DataFrame({i: finalize_column(column, spellings.get(i)) for i, column in enumerate(columns)})
+    df.columns = dedup_column_names(header)
+    return df
+
+
+def scan_excel_sheet(source, sheet_index: int = 0, preview_rows: int = DEFAULT_PREVIEW_ROWS) -> SheetOutline:
+    """
+    读取工作表概况：只转换表头和前若干行，其余行只检查是否为空、有内容的列数，
+    以及布尔值与整数0、1在各列的写法
+
+    Args:
+        source: 文件路径或二进制文件对象
+        sheet_index: 工作表序号
+        preview_rows: 预览的数据行数
+
+    Returns:
+        工作表概况（列名与pandas.read_excel读取后转为字符串的列名一致）
+    """
+    header = None
+    preview = []
+    row_count = 0
+    width = 0
+    spellings = {}
+
+    with SheetReader(source) as reader:
+        for number, row in enumerate(reader.iter_row_elements(sheet_index)):
+            if number == 0:
+                header = reader.parse_row(row) if row is not None else []
+                continue
+            if row is None:
+                if number <= preview_rows:
+                    preview.append([])
+                continue
+
+            extent = reader.row_extent(row)
+            if extent:
+                row_count = number
+                width = max(width, extent)
+                reader.note_spellings(row, spellings)
+            if number <= preview_rows:
+                preview.append(reader.parse_row(row))
+
+    if header is None:
+        return SheetOutline(columns=[], row_count=0)
+
+    preview_df = read_sheet_columns(iter([header] + preview), width, min(preview_rows, row_count), spellings)
+    return SheetOutline(
+        columns=[str(name) for name in preview_df.columns],
+        row_count=row_count,
+        preview=preview_df.head(preview_rows),
+        spellings=spellings
+    )
+
+
+def read_excel_window(
+        source,
+        outline: SheetOutline,
+        columns,
+        start: int = 0,
+        stop: Optional[int] = None,
+        sheet_index: int = 0,
+        categorize: bool = False
+) -> pd.DataFrame:
+    """
+    只读取指定列和行范围的数据
+
+    范围之前的行只由XML解析器跳过，不做单元格转换；读到范围末尾即停止解析；
+    范围内的行也只转换指定的列。各列按值编码读取，相同的值只保存一份。
+
+    Args:
+        source: 文件路径或二进制文件对象
+        outline: 工作表概况（由scan_excel_sheet得到）
+        columns: 需要的列名（不存在的列忽略）
+        start: 起始数据行（从0开始）
+        stop: 结束数据行（不含），默认到最后一行
+        sheet_index: 工作表序号
+        categorize: 唯一值较少（不超过行数的CATEGORICAL_MAX_RATIO）的列以分类类型存储
+
+    Returns:
+        只包含指定列的DataFrame，索引为数据行号（与完整读取时的行号一致）
+    """
+    positions = outline.positions(columns)
+    wanted = set(positions)
+    start = max(0, start)
+    stop = outline.row_count if stop is None else min(stop, outline.row_count)
+    data = [[] for _ in positions]
+    indexes = [{} for _ in positions]
+
+    with SheetReader(source) as reader:
+        rows = reader.iter_row_elements(sheet_index)
+        try:
+            for number, row in enumerate(rows):
+                index = number - 1
+                if index < start:
+                    continue
+                if index >= stop:
+                    break
+
+                cells = reader.parse_row(row, wanted) if row is not None and wanted else []
+                for column, index, position in zip(data, indexes, positions):
+                    value = convert_data_cell(*cells[position]) if position < len(cells) else ""
+                    code = index.get(value)
+                    if code is None:
+                        code = index[value] = len(index)
+                    column.append(code)
+        finally:
+            rows.close()
+
+    df = pd.DataFrame(
+        {
+            i: finalize_encoded_column(
+                column, index, CATEGORICAL_MAX_RATIO if categorize else None, outline.spellings.get(position)
+            )
+            for i, (column, index, position) in enumerate(zip(data, indexes, positions))
+        },
+        index=pd.RangeIndex(start, max(start, stop))
+    )
+    df.columns = [outline.columns[position] for position in positions]
+    return df
+
+
+# ==================== 数据清理 ====================
+
+def clean_categorical_column(column: pd.Series) -> Optional[pd.Series]:
+    """清理分类列：只处理类别，空值归为空字符串类别，去空白后相同的类别合并（结果仍为分类列）"""
+    categories = column.cat.categories.to_numpy()
+    if pd.api.types.infer_dtype(categories, skipna=False) != "string":
+        return clean_column(column.astype(object))
+
+    codes = column.cat.codes.to_numpy()
+    has_na = bool((codes < 0).any())
+    stripped = list(map(str.strip, categories))
+    if not has_na and all(map(operator.is_, stripped, categories)):
+        return None
+
+    labels = np.empty(len(stripped) + 1, dtype=object)
+    labels[:] = stripped + [""]
+    remap, cleaned = pd.factorize(labels)
+    codes = remap[np.where(codes < 0, len(stripped), codes)]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=cleaned),
+        index=column.index,
+        name=column.name
+    )
+
+
+def clean_column(column: pd.Series) -> Optional[pd.Series]:
+    """
+    清理单列：空值转为空字符串，其余转为去除首尾空白的字符串
+
+    Args:
+        column: 原始列
+
+    Returns:
+        清理后的列；已是去除首尾空白的字符串列时返回None（直接沿用原列）
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return clean_categorical_column(column)
+
+    values = column.to_numpy()
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=False) == "string":
+        # 没有首尾空白时str.strip返回原对象，据此判断整列是否已清理
+        stripped = list(map(str.strip, values))
+        if all(map(operator.is_, stripped, values)):
+            return None
+        return pd.Series(np.array(stripped, dtype=object), index=column.index, name=column.name)
+
+    try:
+        return column.fillna("").astype(str).str.strip()
+    except:
+        try:
+            return column.astype(str).str.strip()
+        except:
+            return None
+
+
+def clean_excel_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    清理Excel数据类型，避免混合类型导致的问题（列名和值都转为字符串，空值为空字符串）
+
+    逐列处理且不复制整表：已清理的列直接沿用，只替换需要转换的列。每列耗时记录在
+    结果的attrs[CLEAN_TIMINGS_ATTR]中。
+    """
+    df_clean = df.copy(deep=False)
+    if any(str(col) != col for col in df_clean.columns):
+        df_clean.columns = [str(col) for col in df_clean.columns]
+
+    timings = []
+    for position, col in enumerate(df_clean.columns):
+        started = time.perf_counter()
+        cleaned = clean_column(df_clean.iloc[:, position])
+        if cleaned is not None:
+            df_clean.isetitem(position, cleaned)
+        timings.append((col, time.perf_counter() - started, cleaned is not None))
+
+    df_clean.attrs[CLEAN_TIMINGS_ATTR] = timings
+    return df_clean
+
+
+# ==================== 解析结果缓存 ====================
+
+def estimate_size(value) -> int:
+    """估算缓存值占用的内存（DataFrame按实际字符串大小计算）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, SheetOutline):
+        return estimate_size(value.preview) + sum(len(name) + 64 for name in value.columns)
+    return 0
+
+
+class ExcelDataCache:
+    """
+    Excel解析结果的LRU缓存，按占用内存限制大小
+
+    键由调用方按上传内容哈希、工作表和读取参数组成，内容相同的文件在多个会话间
+    共用同一份解析结果。缓存的值会被多个会话同时使用，调用方不得修改。
+    """
+
+    def __init__(self, max_bytes: int = EXCEL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[tuple, Tuple[object, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, load: Callable[[], object]):
+        """
+        取缓存的解析结果，未命中时调用load解析并放入缓存
+
+        Args:
+            key: 缓存键
+            load: 解析函数（在锁外执行，不阻塞其他会话）
+
+        Returns:
+            解析结果
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                return item[0]
+
+        value = load()
+        value_size = estimate_size(value)
+        if value_size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = (value, value_size)
+                self.size += value_size
+                while self.size > self.max_bytes:
+                    _, (_, old_size) = self._items.popitem(last=False)
+                    self.size -= old_size
+        return value
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._items.clear()
+            self.size = 0
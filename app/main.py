@@ -8,15 +8,12 @@ Word+Excel批量替换工具 v1.5.6
 import os
 import sys
 import tempfile
-from tempfile import NamedTemporaryFile
 import warnings
 import shutil
 import json
 import io
-import zipfile
 import re
-import unicodedata
-import copy
+import html
 from datetime import datetime
 import hashlib
 
@@ -27,15 +24,36 @@ import pandas as pd
 # Word处理库
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
-from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 
 # 数据结构和类型提示
 from dataclasses import dataclass
 from typing import List, Optional, Dict, Tuple, Set
-from collections import defaultdict
 from decimal import Decimal, ROUND_HALF_UP
 
+# 替换引擎（独立模块，供多进程工作进程导入）
+from replace_engine import (
+    MAX_WORD_FILE_SIZE,
+    DEFAULT_BATCH_WORKERS,
+    DEFAULT_BATCH_CHUNK_SIZE,
+    ReplacedFile,
+    BatchTask,
+    export_results_zip,
+    merge_word_documents,
+    BatchJob,
+    JobManager,
+    BRACKET_PAIRS,
+    get_template_index,
+)
+from excel_loader import (
+    CLEAN_TIMINGS_ATTR,
+    SheetOutline,
+    ExcelDataCache,
+    scan_excel_sheet,
+    read_excel_window,
+    clean_excel_types,
+)
+
 # ==================== 配置和常量 ====================
 
 VERSION = "v1.5.6"
@@ -44,10 +62,16 @@ VERSION = "v1.5.6"
 PAGE_SIZE = 10
 WIDGET_HEIGHT = 250
 PREVIEW_ROWS = 50
-MAX_FILENAME_LENGTH = 200
-MAX_WORD_FILE_SIZE = 50 * 1024 * 1024
-MAX_EXCEL_FILE_SIZE = 50 * 1024 * 1024
+WORD_PREVIEW_PAGE_BLOCKS = 40
+MAX_EXCEL_FILE_SIZE = 200 * 1024 * 1024
 MAX_HISTORY_ITEMS = 30
+JOB_POLL_INTERVAL = 1.0
+
+# Word预览中识别为占位符的括号内容（如【姓名】、（金额））
+PLACEHOLDER_PATTERN = re.compile("|".join(
+    f"{re.escape(left)}[^{re.escape(left)}{re.escape(right)}\\n]{{1,30}}{re.escape(right)}"
+    for left, right in BRACKET_PAIRS
+))
 
 # ===== 缓存目录管理 =====
 # 获取用户的本地缓存目录（跨平台兼容）
@@ -61,6 +85,11 @@ CACHE_RULES_DIR = os.path.join(CACHE_BASE_DIR, 'rules')  # 规则缓存目录
 CACHE_HISTORY_DIR = os.path.join(CACHE_BASE_DIR, 'history')  # 历史记录目录
 CACHE_TEMP_DIR = os.path.join(CACHE_BASE_DIR, 'temp')  # 临时文件目录
 
+# 替换结果目录（可通过环境变量指向独立的数据卷）
+CACHE_RESULTS_DIR = os.environ.get(
+    'BATCH_REPLACER_RESULTS_DIR', os.path.join(CACHE_TEMP_DIR, 'results')
+)
+
 # 历史记录文件（放在缓存目录）
 HISTORY_FILE = os.path.join(CACHE_HISTORY_DIR, 'operation_history.json')
 
@@ -382,6 +411,12 @@ HELP_TEXTS = {
     "clear_rules": "清空所有已添加的替换规则",
     "single_download": "下载单个文件到本地",
     "single_log": "查看该文件的详细替换日志",
+    "batch_mode": "单进程在页面线程中逐行生成；多进程并行把数据分块交给多个工作进程同时生成",
+    "batch_workers": "并行的工作进程数，默认等于CPU核数，可按容器的CPU限制调小",
+    "batch_chunk_size": "每次发送给工作进程的行数，行数越多调度开销越小，但进度刷新越慢",
+    "job_attach": "输入任务ID重新连接后台任务，刷新页面或断线后可继续查看进度和结果",
+    "cancel_job": "停止当前后台任务，已生成的文件会保留",
+    "batch_output": "逐个文件会为每行生成独立的Word文件；仅生成合并文档直接把各行内容写入一个文档，不生成独立文件，速度更快",
 }
 
 
@@ -476,16 +511,6 @@ def get_cache_info() -> Dict:
 
 # ==================== 数据结构定义 ====================
 
-@dataclass
-class ReplacedFile:
-    """存储替换后的文件数据结构"""
-    filename: str
-    data: io.BytesIO
-    row_idx: int
-    log: str
-    replace_count: int = 0
-
-
 @dataclass
 class HistoryRecord:
     """历史记录数据结构"""
@@ -497,6 +522,33 @@ class HistoryRecord:
     status: str
 
 
+@dataclass
+class UploadedBuffer:
+    """上传文件的只读内容（每次上传只捕获一次，预览、解析和批量任务共用同一份数据）"""
+    file_id: str
+    name: str
+    data: bytes
+    size: int
+    file_hash: str
+
+    def open(self) -> io.BytesIO:
+        """以流的方式读取（BytesIO直接引用同一个bytes对象，不复制）"""
+        return io.BytesIO(self.data)
+
+
+@dataclass
+class WordPreview:
+    """Word模板预览内容（按文档顺序的段落/表格块，以及从模板段落索引中识别出的占位符）"""
+    blocks: List[Tuple[str, object]]
+    placeholders: List[str]
+    paragraph_count: int
+    table_count: int
+
+    @property
+    def page_count(self) -> int:
+        return max(1, (len(self.blocks) + WORD_PREVIEW_PAGE_BLOCKS - 1) // WORD_PREVIEW_PAGE_BLOCKS)
+
+
 # ==================== 缓存管理器 ====================
 
 class CacheManager:
@@ -727,6 +779,12 @@ def init_session_state():
         "rule_filter": "",
         "show_advanced": False,
         "excel_cache": None,
+        "current_job_id": None,
+        "collected_job_id": None,
+        "export_cache": {},
+        "merged_document_path": "",
+        "upload_buffers": {},
+        "excel_clean_timings": None,
     }
 
     for key, default in required_states.items():
@@ -739,296 +797,273 @@ init_session_state()
 
 # ==================== 核心工具函数 ====================
 
-def clean_text(text: str) -> str:
-    """清理文本：去除首尾空白、隐藏字符、特殊空格，统一格式"""
-    if not isinstance(text, str):
-        return ""
-    text = text.strip()
-    text = unicodedata.normalize("NFKC", text)
-    text = re.sub(r'[\u00A0\u2002-\u200B]', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text
+def get_export_fingerprint(replaced_files: List[ReplacedFile], replace_params: Dict) -> str:
+    """
+    计算导出指纹：由替换参数和每个结果文件的哈希决定
 
+    参数或结果变化时指纹随之变化，旧的导出文件即失效
+    """
+    digest = hashlib.md5(json.dumps(replace_params, sort_keys=True, default=str).encode('utf-8'))
+    for file in replaced_files:
+        digest.update(f"{file.row_idx}|{file.filename}|{file.file_hash}\n".encode('utf-8'))
+    return digest.hexdigest()[:12]
 
-def clean_filename(filename: str) -> str:
-    """清理文件名中的非法字符"""
-    return re.sub(r'[\\/:*?"<>|]', "_", str(filename))
 
+def get_export_path(replaced_files: List[ReplacedFile], fingerprint: str, export_mode: str) -> str:
+    """导出文件路径（与结果文件放在同一任务目录，随任务一起清理）"""
+    export_dir = os.path.dirname(replaced_files[0].path)
+    if export_mode == "zip":
+        return os.path.join(export_dir, f"export_{fingerprint}.zip")
+    return os.path.join(export_dir, f"merged_{fingerprint}.docx")
 
-def generate_safe_filename(
-        excel_row: pd.Series,
-        file_name_col: str,
-        file_prefix: str = "",
-        file_suffix: str = "",
-        row_idx: int = 0,
-        max_length: int = MAX_FILENAME_LENGTH
-) -> str:
-    """安全生成文件名，处理超长名称和特殊字符"""
-    try:
-        if file_name_col and file_name_col in excel_row.index:
-            base_name = clean_text(str(excel_row[file_name_col]))
-        else:
-            base_name = f"文件_{row_idx + 1}"
 
-        if not base_name or base_name.isspace():
-            base_name = f"文件_{row_idx + 1}"
+def sync_export_cache(fingerprint: str) -> None:
+    """指纹变化时删除旧的导出文件"""
+    cache = st.session_state.export_cache
+    if cache.get("fingerprint") == fingerprint:
+        return
 
-        if file_prefix and file_suffix:
-            filename = f"{file_prefix}{base_name}{file_suffix}.docx"
-        elif file_prefix:
-            filename = f"{file_prefix}{base_name}.docx"
-        elif file_suffix:
-            filename = f"{base_name}{file_suffix}.docx"
-        else:
-            filename = f"{base_name}.docx"
-
-        filename = clean_filename(filename)
-
-        filename_bytes = filename.encode('utf-8')
-        if len(filename_bytes) > max_length:
-            truncated_base = base_name
-            while len(f"{file_prefix}{truncated_base}{file_suffix}.docx".encode('utf-8')) > max_length:
-                truncated_base = truncated_base[:-1]
-
-            if file_prefix and file_suffix:
-                filename = f"{file_prefix}{truncated_base}{file_suffix}.docx"
-            elif file_prefix:
-                filename = f"{file_prefix}{truncated_base}.docx"
-            elif file_suffix:
-                filename = f"{truncated_base}{file_suffix}.docx"
-            else:
-                filename = f"{truncated_base}.docx"
+    for path in cache.get("artifacts", {}).values():
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
 
-            filename = clean_filename(filename)
+    st.session_state.export_cache = {"fingerprint": fingerprint, "artifacts": {}}
 
-        return filename
 
-    except:
-        return f"文件_{row_idx + 1}.docx"
+def read_file_bytes(path: str) -> bytes:
+    """读取文件内容（下载按钮会缓存整个内容，读完即关闭文件）"""
+    with open(path, 'rb') as f:
+        return f.read()
 
 
-def precompute_replace_patterns(
-        replace_rules: List[Tuple[str, str]],
-        excel_row: pd.Series
-) -> List[Tuple[str, str, str, str]]:
-    """预计算所有需要替换的模式"""
-    replace_patterns = []
+def read_export_artifact(replaced_files: List[ReplacedFile], export_path: str, export_mode: str) -> bytes:
+    """
+    读取导出文件，不存在时才生成（点击下载时在后台线程执行）
 
-    for old_text, col_name in replace_rules:
-        if col_name in excel_row.index:
-            replacement = str(excel_row[col_name]).strip()
-        else:
-            replacement = ""
-
-        cleaned_text = clean_text(old_text)
-
-        if not cleaned_text:
-            continue
-
-        if st.session_state.replace_scope == "仅替换括号内内容":
-            if cleaned_text.startswith("【") and cleaned_text.endswith("】"):
-                new_format = f"【{replacement}】"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            elif cleaned_text.startswith("（") and cleaned_text.endswith("）"):
-                new_format = f"（{replacement}）"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            elif cleaned_text.startswith("(") and cleaned_text.endswith(")"):
-                new_format = f"({replacement})"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            elif cleaned_text.startswith("〔") and cleaned_text.endswith("〕"):
-                new_format = f"〔{replacement}〕"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            else:
-                replace_patterns.append((old_text, col_name, cleaned_text, replacement))
+    Returns:
+        导出文件内容
+    """
+    if not os.path.exists(export_path):
+        if export_mode == "zip":
+            export_results_zip(replaced_files, export_path)
         else:
-            replace_patterns.append((old_text, col_name, cleaned_text, replacement))
+            merge_word_documents(replaced_files, export_path)
 
-    return replace_patterns
+    return read_file_bytes(export_path)
 
 
-def process_paragraph(
-        paragraph,
-        replace_patterns: List[Tuple[str, str, str, str]],
-        cleaned_para: str = None
+def get_replace_params(
+        word_file: Optional[st.runtime.uploaded_file_manager.UploadedFile],
+        excel_rows: int,
+        start_row: int,
+        end_row: int,
+        file_name_col: str,
+        file_prefix: str,
+        file_suffix: str,
+        merge_only: bool = False
 ) -> Dict:
-    """处理单个段落的关键字替换"""
-    para_text = paragraph.text
-    if cleaned_para is None:
-        cleaned_para = clean_text(para_text)
-    replace_count = defaultdict(int)
-
-    if not para_text or not replace_patterns:
-        return replace_count
-
-    has_keyword = False
-
-    for old_text, col_name, format_keyword, replacement in replace_patterns:
-        if format_keyword and format_keyword in cleaned_para:
-            has_keyword = True
-            break
-
-    if has_keyword:
-        new_text = para_text
-        for old_text, col_name, format_keyword, replacement in replace_patterns:
-            if format_keyword and format_keyword in cleaned_para:
-                count = new_text.count(format_keyword)
-                if count > 0:
-                    new_text = new_text.replace(format_keyword, replacement)
-                    replace_count[(old_text, col_name)] += count
-
-        if len(paragraph.runs) > 0:
-            paragraph.runs[0].text = new_text
-            for i in range(1, len(paragraph.runs)):
-                paragraph.runs[i].text = ''
-
-    return replace_count
-
-
-def replace_word_with_format(
-        word_file: st.runtime.uploaded_file_manager.UploadedFile,
-        excel_row: pd.Series,
-        replace_rules: List[Tuple[str, str]]
-) -> Tuple[io.BytesIO, str, int]:
-    """替换Word文件中的关键字，保留格式"""
-    replace_count = defaultdict(int)
-    total_replace = 0
+    """获取替换参数，用于判断是否需要重新替换"""
+    return {
+        "word_filename": word_file.name if word_file else "",
+        "excel_rows": excel_rows,
+        "start_row": start_row,
+        "end_row": end_row,
+        "file_name_col": file_name_col,
+        "rule_count": len(st.session_state.replace_rules),
+        "rule_hash": hash(tuple(st.session_state.replace_rules)),
+        "merge_only": merge_only
+    }
 
-    try:
-        file_size = len(word_file.getvalue())
-        if file_size > MAX_WORD_FILE_SIZE:
-            raise ValueError(f"文件过大")
-
-        doc = Document(io.BytesIO(word_file.getvalue()))
-
-        replace_patterns = precompute_replace_patterns(replace_rules, excel_row)
-
-        if not replace_patterns:
-            output_file = io.BytesIO()
-            doc.save(output_file)
-            output_file.seek(0)
-            return output_file, "⚠ 未找到匹配规则", 0
-
-        for paragraph in doc.paragraphs:
-            para_count = process_paragraph(paragraph, replace_patterns)
-            for key, count in para_count.items():
-                replace_count[key] += count
-                total_replace += count
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        para_count = process_paragraph(paragraph, replace_patterns)
-                        for key, count in para_count.items():
-                            replace_count[key] += count
-                            total_replace += count
-
-        output_file = io.BytesIO()
-        doc.save(output_file)
-        output_file.seek(0)
-
-        if replace_count:
-            log_lines = [f"✓ {old}" for old, _ in replace_count.keys()]
-            replace_log = ", ".join(log_lines[:3])
-            if len(replace_count) > 3:
-                replace_log += f" 等{len(replace_count) - 3}个"
-        else:
-            replace_log = "⚠ 无替换"
 
-        return output_file, replace_log, total_replace
+def capture_upload(uploaded_file, slot: str) -> UploadedBuffer:
+    """
+    捕获上传文件内容：同一次上传只读取并计算哈希一次，页面重跑时直接复用
 
-    except Exception as e:
-        return io.BytesIO(), f"❌ 失败", 0
+    Args:
+        uploaded_file: Streamlit上传的文件
+        slot: 上传位置（word/excel），每个位置只保留当前文件
 
+    Returns:
+        上传文件的只读内容
+    """
+    buffers = st.session_state.upload_buffers
+    buffer = buffers.get(slot)
+    if buffer is None or buffer.file_id != uploaded_file.file_id:
+        # UploadedFile是写时复制的BytesIO，getvalue()直接返回上传记录中的bytes
+        data = uploaded_file.getvalue()
+        buffer = UploadedBuffer(
+            file_id=uploaded_file.file_id,
+            name=uploaded_file.name,
+            data=data,
+            size=uploaded_file.size,
+            file_hash=hashlib.md5(data).hexdigest()
+        )
+        buffers[slot] = buffer
+    return buffer
 
-def merge_word_documents(
-        replaced_files: List[ReplacedFile]
-) -> io.BytesIO:
-    """合并多个Word文档（保留所有格式和结构）"""
-    if not replaced_files:
-        raise ValueError("没有文件")
 
-    try:
-        main_doc = Document(io.BytesIO(replaced_files[0].data.getvalue()))
-        main_body = main_doc._body._element
+def load_excel_outline(excel_buffer: UploadedBuffer) -> SheetOutline:
+    """
+    读取Excel概况（列名、行数和清理后的预览行）
 
-        for idx in range(1, len(replaced_files)):
-            try:
-                file = replaced_files[idx]
+    结果按文件内容哈希缓存：页面重跑时直接使用会话中保存的结果，其他会话上传
+    相同文件时从全局缓存取得，不再重复解析。
+    """
+    cached = st.session_state.excel_cache
+    if cached and cached["file_hash"] == excel_buffer.file_hash:
+        return cached["outline"]
+
+    def load() -> SheetOutline:
+        outline = scan_excel_sheet(excel_buffer.open(), preview_rows=PREVIEW_ROWS)
+        outline.preview = clean_excel_types(outline.preview)
+        return outline
+
+    outline = get_excel_cache().get(("outline", excel_buffer.file_hash, 0, PREVIEW_ROWS), load)
+    st.session_state.excel_cache = {"file_hash": excel_buffer.file_hash, "outline": outline}
+    return outline
+
+
+def load_excel_data(
+        excel_buffer: UploadedBuffer,
+        outline: SheetOutline,
+        columns: List[str],
+        start: int,
+        stop: int
+) -> pd.DataFrame:
+    """读取指定列和行范围的清理后数据（按文件内容哈希、列和行范围缓存；唯一值较少的列以分类类型存储）"""
+    key = ("window", excel_buffer.file_hash, 0, tuple(outline.positions(columns)), start, stop)
+    return get_excel_cache().get(
+        key,
+        lambda: clean_excel_types(
+            read_excel_window(excel_buffer.open(), outline, columns, start, stop, categorize=True)
+        )
+    )
 
-                if not file.data or len(file.data.getvalue()) == 0:
-                    continue
 
-                sub_doc = Document(io.BytesIO(file.data.getvalue()))
-                sub_body = sub_doc._body._element
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_word_preview(file_hash: str, _template_bytes: bytes) -> WordPreview:
+    """
+    解析Word模板生成预览内容（按模板内容哈希缓存，页面重跑时不再解析）
 
-                page_break_para = OxmlElement('w:p')
-                page_break_pPr = OxmlElement('w:pPr')
+    解析时同时建立模板段落索引，占位符从索引中识别；索引进入替换引擎的缓存，
+    之后编译同一模板时直接复用。
 
-                page_break_element = OxmlElement('w:pageBreakBefore')
-                page_break_element.set(qn('w:val'), '1')
+    Args:
+        file_hash: 模板内容哈希（缓存键，模板内容本身不参与哈希计算）
+        _template_bytes: Word模板文件内容
 
-                page_break_pPr.append(page_break_element)
-                page_break_para.append(page_break_pPr)
-                main_body.append(page_break_para)
+    Returns:
+        预览内容
+    """
+    doc = Document(io.BytesIO(_template_bytes))
+    index = get_template_index(_template_bytes, doc)
+
+    blocks = []
+    paragraph_count = 0
+    table_count = 0
+    for child in doc.element.body:
+        if child.tag == qn("w:p"):
+            paragraph_count += 1
+            if child.text.strip():
+                blocks.append(("p", child.text))
+        elif child.tag == qn("w:tbl"):
+            table_count += 1
+            rows = [
+                ["\n".join(p.text for p in cell.iter(qn("w:p"))) for cell in row.iterchildren(qn("w:tc"))]
+                for row in child.iterchildren(qn("w:tr"))
+            ]
+            blocks.append(("table", rows))
 
-                for element in sub_body:
-                    main_body.append(copy.deepcopy(element))
+    for para in index.paragraphs:
+        if para.location == "文本框":
+            blocks.append(("textbox", para.text))
 
-            except:
-                continue
+    placeholders = dict.fromkeys(
+        match.group() for para in index.paragraphs for match in PLACEHOLDER_PATTERN.finditer(para.text)
+    )
 
-        output = io.BytesIO()
-        main_doc.save(output)
-        output.seek(0)
-        return output
+    return WordPreview(
+        blocks=blocks,
+        placeholders=list(placeholders),
+        paragraph_count=paragraph_count,
+        table_count=table_count
+    )
 
-    except Exception as e:
-        raise
 
+def highlight_placeholders(text: str) -> str:
+    """转义文本为HTML，并用<mark>标出其中的占位符"""
+    parts = []
+    pos = 0
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        parts.append(html.escape(text[pos:match.start()]))
+        placeholder = html.escape(match.group())
+        parts.append(f"<mark class='ph' data-key=\"{placeholder}\">{placeholder}</mark>")
+        pos = match.end()
+    parts.append(html.escape(text[pos:]))
+    return "".join(parts).replace("\n", "<br>")
 
-def get_replace_params(
-        word_file: Optional[st.runtime.uploaded_file_manager.UploadedFile],
-        excel_df: Optional[pd.DataFrame],
-        start_row: int,
-        end_row: int,
-        file_name_col: str,
-        file_prefix: str,
-        file_suffix: str
-) -> Dict:
-    """获取替换参数，用于判断是否需要重新替换"""
-    return {
-        "word_filename": word_file.name if word_file else "",
-        "excel_rows": len(excel_df) if excel_df is not None else 0,
-        "start_row": start_row,
-        "end_row": end_row,
-        "file_name_col": file_name_col,
-        "rule_count": len(st.session_state.replace_rules),
-        "rule_hash": hash(tuple(st.session_state.replace_rules))
-    }
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def render_word_preview_page(file_hash: str, page: int, _preview: WordPreview) -> str:
+    """
+    生成Word预览某一页的HTML（按模板内容哈希和页码缓存，只在翻到该页时生成）
 
-def clean_excel_types(df: pd.DataFrame) -> pd.DataFrame:
-    """清理Excel数据类型，避免混合类型导致的问题"""
-    df_clean = df.copy()
+    Args:
+        file_hash: 模板内容哈希
+        page: 页码（从1开始）
+        _preview: 预览内容
 
-    for col in df_clean.columns:
-        try:
-            col_name = str(col)
-            if col_name != col:
-                df_clean = df_clean.rename(columns={col: col_name})
-                col = col_name
+    Returns:
+        该页HTML
+    """
+    start = (page - 1) * WORD_PREVIEW_PAGE_BLOCKS
+    table_number = sum(1 for kind, _ in _preview.blocks[:start] if kind == "table")
+
+    html_content = ""
+    for kind, content in _preview.blocks[start:start + WORD_PREVIEW_PAGE_BLOCKS]:
+        if kind == "table":
+            table_number += 1
+            html_content += f"<p style='margin-top: 8px; font-weight: bold; color: #1f77b4;'>📊 表格{table_number}：</p>"
+            html_content += "<table style='border-collapse: collapse; width: 100%; font-size: 12px;'>"
+            for row in content:
+                html_content += "<tr>"
+                for cell_text in row:
+                    html_content += f"<td style='border: 1px solid #ccc; padding: 4px;'>{highlight_placeholders(cell_text)}</td>"
+                html_content += "</tr>"
+            html_content += "</table>"
+        elif kind == "textbox":
+            html_content += f"<p style='margin: 4px 0; word-break: break-all; color: #555;'>🗒️ {highlight_placeholders(content)}</p>"
+        else:
+            html_content += f"<p style='margin: 4px 0; word-break: break-all;'>{highlight_placeholders(content)}</p>"
 
-            df_clean[col] = df_clean[col].fillna("")
-            df_clean[col] = df_clean[col].astype(str).str.strip()
+    return html_content
 
-        except:
-            try:
-                df_clean[col] = df_clean[col].astype(str).str.strip()
-            except:
-                pass
 
-    return df_clean
+def format_clean_timings(timings: List[Tuple[str, float, bool]]) -> Tuple[str, str]:
+    """
+    格式化逐列清理耗时
+
+    Args:
+        timings: [(列名, 秒数, 是否做了转换)]
+
+    Returns:
+        (摘要, 逐列明细)
+    """
+    total_ms = sum(seconds for _, seconds, _ in timings) * 1000
+    converted = sum(1 for _, _, cleaned in timings if cleaned)
+    slowest = sorted(timings, key=lambda item: item[1], reverse=True)[:3]
+
+    summary = f"🧹 数据清理 {total_ms:.0f}ms：转换{converted}列，{len(timings) - converted}列无需转换"
+    if slowest:
+        summary += "；最慢：" + "、".join(f"{col} {seconds * 1000:.0f}ms" for col, seconds, _ in slowest)
+    details = "\n".join(
+        f"- {col}：{seconds * 1000:.1f}ms{'' if cleaned else '（无需转换）'}"
+        for col, seconds, cleaned in timings
+    )
+    return summary, details
 
 
 def get_file_hash(file_data: bytes) -> str:
@@ -1046,7 +1081,7 @@ def export_statistics_to_csv(replaced_files: List[ReplacedFile]) -> str:
                 "文件名": file.filename,
                 "行号": file.row_idx + 1,
                 "替换次数": file.replace_count,
-                "状态": "✅" if file.data and len(file.data.getvalue()) > 0 else "❌"
+                "状态": "✅" if file.is_success else "❌"
             })
 
         df = pd.DataFrame(data)
@@ -1075,9 +1110,61 @@ def get_keyword_statistics(replace_rules: List[Tuple[str, str]],
     return stats
 
 
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """获取全局任务管理器（跨页面重跑和会话共享）"""
+    return JobManager(CACHE_RESULTS_DIR)
+
+
+@st.cache_resource
+def get_excel_cache() -> ExcelDataCache:
+    """获取全局Excel解析缓存（跨页面重跑和会话共享）"""
+    return ExcelDataCache()
+
+
+def collect_job_results(job: BatchJob) -> None:
+    """把已结束任务的结果取回到当前会话"""
+    st.session_state.replaced_files = job.results
+    st.session_state.replace_log = job.log
+    st.session_state.merged_document_path = job.merged_path
+    st.session_state.collected_job_id = job.job_id
+
+    if job.state == "done":
+        st.session_state.replace_params = job.params
+
+    if job.state != "failed" and not job.meta.get("history_recorded"):
+        job.meta["history_recorded"] = True
+        history_manager.add_record(HistoryRecord(
+            timestamp=datetime.now().strftime("%m-%d %H:%M"),
+            word_file=job.meta.get("word_file", "")[:20],
+            excel_file=job.meta.get("excel_file", "")[:20],
+            rules_count=job.meta.get("rules_count", 0),
+            files_generated=len(job.results),
+            status="success" if job.state == "done" else job.state
+        ))
+
+
 # ==================== 创建管理器实例 ====================
 cache_manager = CacheManager()
 history_manager = HistoryManager()
+job_manager = get_job_manager()
+
+# ==================== 后台任务同步 ====================
+# 刷新页面或断线重连后，根据地址栏中的任务ID重新连接任务
+if st.session_state.current_job_id is None and "job" in st.query_params:
+    if job_manager.get(st.query_params["job"]) is not None:
+        st.session_state.current_job_id = st.query_params["job"]
+
+current_job = job_manager.get(st.session_state.current_job_id) if st.session_state.current_job_id else None
+st.session_state.is_replacing = current_job is not None and not current_job.is_finished
+
+job_just_finished = (
+        current_job is not None and
+        current_job.is_finished and
+        st.session_state.collected_job_id != current_job.job_id
+)
+if job_just_finished:
+    collect_job_results(current_job)
 
 # ==================== 侧栏 ====================
 with st.sidebar:
@@ -1174,6 +1261,31 @@ with st.sidebar:
             history_manager.clear_history()
             st.rerun()
 
+    st.markdown("---")
+
+    # 后台任务
+    st.subheader("🔗 后台任务")
+
+    if st.session_state.current_job_id:
+        st.caption(f"当前任务ID：`{st.session_state.current_job_id}`")
+
+    attach_job_id = st.text_input(
+        "任务ID",
+        key="attach_job_id",
+        placeholder="输入任务ID",
+        label_visibility="collapsed",
+        help=HELP_TEXTS["job_attach"]
+    ).strip()
+
+    if st.button("🔗 连接任务", key="attach_job", use_container_width=True, disabled=not attach_job_id):
+        if job_manager.get(attach_job_id) is not None:
+            st.session_state.current_job_id = attach_job_id
+            st.session_state.collected_job_id = None
+            st.query_params["job"] = attach_job_id
+            st.rerun()
+        else:
+            st.warning("⚠️ 任务不存在或已过期", icon="⚠️")
+
 # ==================== 主页面 - 标题 ====================
 col_title1, col_title2 = st.columns([8, 2])
 with col_title1:
@@ -1187,8 +1299,7 @@ with col_title2:
 if st.session_state.replaced_files and st.session_state.replace_params:
     progress_col, status_col = st.columns([3, 1])
     with progress_col:
-        success_count = len([f for f in st.session_state.replaced_files
-                             if f.data and len(f.data.getvalue()) > 0])
+        success_count = len([f for f in st.session_state.replaced_files if f.is_success])
         total_count = len(st.session_state.replaced_files)
         st.progress(success_count / total_count if total_count > 0 else 0)
     with status_col:
@@ -1216,15 +1327,18 @@ with col_main_left:
             label_visibility="collapsed",
             help="仅支持.docx格式"
         )
+        word_buffer = None
         if word_file:
-            file_size_bytes = len(word_file.getvalue())
-            file_size_str = format_file_size(file_size_bytes)
+            file_size_str = format_file_size(word_file.size)
 
-            if file_size_bytes > MAX_WORD_FILE_SIZE:
+            if word_file.size > MAX_WORD_FILE_SIZE:
                 st.error(f"❌ 文件过大：{file_size_str}", icon="❌")
                 word_file = None
             else:
+                word_buffer = capture_upload(word_file, "word")
                 st.caption(f"✅ {file_size_str}")
+        if word_buffer is None:
+            st.session_state.upload_buffers.pop("word", None)
 
     with col_upload2:
         st.markdown(create_tooltip("**Excel数据**", "excel_upload"), unsafe_allow_html=True)
@@ -1236,15 +1350,18 @@ with col_main_left:
             label_visibility="collapsed",
             help="支持.xlsx/.xls格式"
         )
+        excel_buffer = None
         if excel_file:
-            file_size_bytes = len(excel_file.getvalue())
-            file_size_str = format_file_size(file_size_bytes)
+            file_size_str = format_file_size(excel_file.size)
 
-            if file_size_bytes > MAX_EXCEL_FILE_SIZE:
+            if excel_file.size > MAX_EXCEL_FILE_SIZE:
                 st.error(f"❌ 文件过大：{file_size_str}", icon="❌")
                 excel_file = None
             else:
+                excel_buffer = capture_upload(excel_file, "excel")
                 st.caption(f"✅ {file_size_str}")
+        if excel_buffer is None:
+            st.session_state.upload_buffers.pop("excel", None)
 
     st.markdown("---")
 
@@ -1252,36 +1369,42 @@ with col_main_left:
     with st.expander("👀 文件预览 - 点击查看/复制内容", expanded=False):
         col_prev1, col_prev2 = st.columns(2, gap="small")
 
-        excel_df = None
+        excel_outline = None
         excel_cols = []
 
         with col_prev1:
             st.markdown("**Word文档内容**")
             if word_file:
                 try:
-                    doc = Document(io.BytesIO(word_file.getvalue()))
-
-                    html_content = ""
-
-                    for para in doc.paragraphs[:15]:
-                        if para.text.strip():
-                            text = para.text.replace("<", "&lt;").replace(">", "&gt;")
-                            html_content += f"<p style='margin: 4px 0; word-break: break-all;'>{text}</p>"
-
-                    for table_idx, table in enumerate(doc.tables[:2]):
-                        html_content += f"<p style='margin-top: 8px; font-weight: bold; color: #1f77b4;'>📊 表格{table_idx + 1}：</p>"
-                        html_content += "<table style='border-collapse: collapse; width: 100%; font-size: 12px;'>"
-
-                        for row_idx, row in enumerate(table.rows[:10]):
-                            html_content += "<tr>"
-                            for cell in row.cells:
-                                cell_text = cell.text.replace("<", "&lt;").replace(">", "&gt;")[:30]
-                                html_content += f"<td style='border: 1px solid #ccc; padding: 4px;'>{cell_text}</td>"
-                            html_content += "</tr>"
-
-                        html_content += "</table>"
+                    preview = build_word_preview(word_buffer.file_hash, word_buffer.data)
+
+                    page = 1
+                    if preview.page_count > 1:
+                        page = st.number_input(
+                            f"页码（共{preview.page_count}页）",
+                            min_value=1,
+                            max_value=preview.page_count,
+                            value=1,
+                            step=1,
+                            key=f"word_preview_page_{word_buffer.file_hash}"
+                        )
+                    html_content = render_word_preview_page(word_buffer.file_hash, int(page), preview)
+
+                    # 已添加规则的占位符用绿色标出，其余识别到的占位符用黄色
+                    used_keys = {keyword for keyword, _ in st.session_state.replace_rules}
+                    highlight_css = "".join(
+                        f"mark.ph[data-key=\"{key}\"] {{ background-color: #c8e6c9; }}"
+                        for key in (
+                            placeholder.replace("\\", "\\\\").replace('"', '\\"').replace("<", "\\3c ")
+                            for placeholder in preview.placeholders if placeholder in used_keys
+                        )
+                    )
 
                     st.components.v1.html(f"""
+                    <style>
+                        mark.ph {{ background-color: #fff3b0; padding: 0 1px; border-radius: 2px; }}
+                        {highlight_css}
+                    </style>
                     <div style='height: 280px; overflow-y: auto; padding: 12px; border: 1px solid #e0e0e0; 
                                 border-radius: 6px; font-size: 13px; line-height: 1.6; background-color: #f9f9f9;
                                 font-family: "Segoe UI", Tahoma, Geneva, Verdana, sans-serif; word-wrap: break-word;
@@ -1290,7 +1413,10 @@ with col_main_left:
                     </div>
                     """, height=300)
 
-                    st.caption(f"📄 {len(doc.paragraphs)}段落，{len(doc.tables)}表格")
+                    st.caption(
+                        f"📄 {preview.paragraph_count}段落，{preview.table_count}表格，"
+                        f"识别到{len(preview.placeholders)}个占位符"
+                    )
                     st.info("💡 可以在上方选中内容按Ctrl+C复制，粘贴到下方关键字输入框中", icon="ℹ️")
 
                 except Exception as e:
@@ -1302,55 +1428,41 @@ with col_main_left:
             st.markdown("**Excel数据预览**")
             if excel_file:
                 try:
-                    with NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_excel:
-                        temp_excel.write(excel_file.getvalue())
-                        excel_path = temp_excel.name
-
-                    try:
-                        with pd.ExcelFile(excel_path, engine="openpyxl") as excel_wb:
-                            sheet_names = excel_wb.sheet_names
-                            selected_sheet = sheet_names[0]
-
-                            excel_df = pd.read_excel(
-                                excel_wb,
-                                sheet_name=selected_sheet,
-                                dtype=str,
-                                keep_default_na=False,
-                                na_values=[]
-                            )
-
-                            if excel_df.empty:
-                                st.warning("⚠️ 表格为空", icon="⚠️")
-                            else:
-                                excel_df = clean_excel_types(excel_df)
-                                excel_cols = excel_df.columns.tolist()
-
-                                preview_df = excel_df.head(PREVIEW_ROWS)
-
-                                st.dataframe(
-                                    preview_df,
-                                    use_container_width=True,
-                                    hide_index=True,
-                                    height=280
-                                )
-
-                                col_s1, col_s2 = st.columns(2)
-                                with col_s1:
-                                    st.metric("行数", len(excel_df))
-                                with col_s2:
-                                    st.metric("列数", len(excel_cols))
-
-                    finally:
-                        try:
-                            os.unlink(excel_path)
-                        except:
-                            pass
+                    # 只读取列名、行数和预览行，替换时再按规则用到的列和行范围读取数据
+                    excel_outline = load_excel_outline(excel_buffer)
+
+                    if excel_outline.row_count == 0:
+                        st.warning("⚠️ 表格为空", icon="⚠️")
+                    else:
+                        excel_cols = excel_outline.columns
+
+                        preview_df = excel_outline.preview
+
+                        st.dataframe(
+                            preview_df,
+                            use_container_width=True,
+                            hide_index=True,
+                            height=280
+                        )
+
+                        col_s1, col_s2 = st.columns(2)
+                        with col_s1:
+                            st.metric("行数", excel_outline.row_count)
+                        with col_s2:
+                            st.metric("列数", len(excel_cols))
+
+                        clean_timings = st.session_state.excel_clean_timings
+                        if clean_timings and clean_timings["file_hash"] == excel_buffer.file_hash:
+                            summary, details = format_clean_timings(clean_timings["timings"])
+                            st.caption(summary, help=details)
 
                 except Exception as e:
                     st.error(f"❌ 读取失败", icon="❌")
             else:
                 st.info("请上传Excel文件", icon="ℹ️")
 
+excel_rows = excel_outline.row_count if excel_outline is not None else 0
+
 # ==================== 右侧：规则管理 ====================
 with col_main_right:
     st.subheader("📋 规则管理")
@@ -1529,10 +1641,10 @@ with col_config2:
     start_row = st.number_input(
         "开始",
         min_value=1,
-        max_value=len(excel_df) if excel_df is not None and len(excel_df) > 0 else 1,
+        max_value=excel_rows if excel_rows > 0 else 1,
         value=1,
         key="start_row",
-        disabled=excel_df is None or len(excel_df) == 0,
+        disabled=excel_rows == 0,
         label_visibility="collapsed",
         help=HELP_TEXTS["start_row"]
     )
@@ -1542,10 +1654,10 @@ with col_config3:
     end_row = st.number_input(
         "结束",
         min_value=1,
-        max_value=len(excel_df) if excel_df is not None and len(excel_df) > 0 else 1,
-        value=len(excel_df) if excel_df is not None and len(excel_df) > 0 else 1,
+        max_value=excel_rows if excel_rows > 0 else 1,
+        value=excel_rows if excel_rows > 0 else 1,
         key="end_row",
-        disabled=excel_df is None or len(excel_df) == 0,
+        disabled=excel_rows == 0,
         label_visibility="collapsed",
         help=HELP_TEXTS["end_row"]
     )
@@ -1565,13 +1677,62 @@ with col_config4:
 if start_row > end_row:
     st.error("❌ 起始行不能大于结束行", icon="❌")
 
+# 性能设置
+with st.expander("⚡ 性能设置", expanded=False):
+    col_perf1, col_perf2, col_perf3, col_perf4 = st.columns(4, gap="small")
+
+    with col_perf1:
+        st.markdown(create_tooltip("**执行方式**", "batch_mode"), unsafe_allow_html=True)
+        batch_mode = st.radio(
+            "执行方式",
+            options=["单进程", "多进程并行"],
+            key="batch_mode",
+            horizontal=True,
+            label_visibility="collapsed"
+        )
+
+    with col_perf2:
+        st.markdown(create_tooltip("**工作进程数**", "batch_workers"), unsafe_allow_html=True)
+        batch_workers = st.number_input(
+            "进程数",
+            min_value=1,
+            max_value=max(DEFAULT_BATCH_WORKERS * 4, 64),
+            value=DEFAULT_BATCH_WORKERS,
+            key="batch_workers",
+            disabled=batch_mode != "多进程并行",
+            label_visibility="collapsed"
+        )
+
+    with col_perf3:
+        st.markdown(create_tooltip("**分块行数**", "batch_chunk_size"), unsafe_allow_html=True)
+        batch_chunk_size = st.number_input(
+            "分块",
+            min_value=1,
+            max_value=10000,
+            value=DEFAULT_BATCH_CHUNK_SIZE,
+            key="batch_chunk_size",
+            disabled=batch_mode != "多进程并行",
+            label_visibility="collapsed"
+        )
+
+    with col_perf4:
+        st.markdown(create_tooltip("**生成内容**", "batch_output"), unsafe_allow_html=True)
+        batch_output = st.radio(
+            "生成内容",
+            options=["逐个文件", "仅生成合并文档"],
+            key="batch_output",
+            horizontal=True,
+            label_visibility="collapsed"
+        )
+
 st.markdown("---")
 
 # ==================== 执行替换 ====================
-can_replace = word_file and excel_df is not None and len(excel_df) > 0 and len(st.session_state.replace_rules) > 0
+can_replace = word_file and excel_rows > 0 and len(st.session_state.replace_rules) > 0
 
 current_params = get_replace_params(
-    word_file, excel_df, start_row, end_row, file_name_col, file_prefix, ""
+    word_file, excel_rows, start_row, end_row, file_name_col, file_prefix, "",
+    merge_only=batch_output == "仅生成合并文档"
 )
 
 need_replace = (
@@ -1597,75 +1758,90 @@ with col_exec2:
     elif len(st.session_state.replaced_files) > 0 and not need_replace:
         st.success(f"✅ {len(st.session_state.replaced_files)}个", icon="✅")
 
-# 执行替换逻辑
-if replace_btn and not st.session_state.is_replacing:
-    st.session_state.is_replacing = True
-    st.session_state.replaced_files = []
-    st.session_state.replace_log = []
-
-    progress_bar = st.progress(0)
-    progress_text = st.empty()
+with col_exec3:
+    if st.session_state.is_replacing:
+        if st.button("⏹️ 取消任务", key="cancel_job", use_container_width=True, help=HELP_TEXTS["cancel_job"]):
+            job_manager.cancel(st.session_state.current_job_id)
+            st.rerun()
 
-    try:
-        actual_end_row = min(end_row, len(excel_df))
-        if start_row > actual_end_row:
-            st.error("❌ 行号超出范围", icon="❌")
-        else:
-            total_rows = actual_end_row - start_row + 1
 
-            for idx, row_idx in enumerate(range(start_row - 1, actual_end_row)):
-                try:
-                    excel_row = excel_df.iloc[row_idx]
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_job_progress(job_id: str):
+    """轮询显示后台任务进度，任务结束后刷新整个页面"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return
 
-                    replaced_file, replace_log, replace_cnt = replace_word_with_format(
-                        word_file, excel_row, st.session_state.replace_rules
-                    )
+    if job.is_finished:
+        st.rerun()
 
-                    filename = generate_safe_filename(
-                        excel_row,
-                        file_name_col if file_name_col != "未选择" else "",
-                        file_prefix,
-                        "",
-                        row_idx
-                    )
+    st.progress(job.progress)
+    st.caption(f"{job.processed}/{job.total} · 任务ID：{job.job_id}")
 
-                    st.session_state.replaced_files.append(ReplacedFile(
-                        filename=filename,
-                        data=replaced_file,
-                        row_idx=row_idx,
-                        log=replace_log,
-                        replace_count=replace_cnt
-                    ))
 
-                    st.session_state.replace_log.append(f"【{row_idx + 1}】{replace_log}")
+# 后台任务进度
+if st.session_state.is_replacing:
+    render_job_progress(st.session_state.current_job_id)
+elif job_just_finished:
+    if current_job.state == "done":
+        st.success(f"🎉 完成！{len(st.session_state.replaced_files)} 个文件", icon="✅")
+    elif current_job.state == "cancelled":
+        st.warning(f"⏹️ 已取消，已生成 {len(st.session_state.replaced_files)} 个文件", icon="⚠️")
+    else:
+        st.error(f"❌ 出错", icon="❌")
 
-                    progress = (idx + 1) / total_rows
-                    progress_bar.progress(progress)
-                    progress_text.text(f"{idx + 1}/{total_rows}")
+# 提交后台任务
+if replace_btn and not st.session_state.is_replacing:
+    actual_end_row = min(end_row, excel_rows)
+    excel_df = None
+    if start_row > actual_end_row:
+        st.error("❌ 行号超出范围", icon="❌")
+    else:
+        # 只读取规则和文件名用到的列、所选范围内的行
+        used_cols = [col_name for _, col_name in st.session_state.replace_rules]
+        if file_name_col != "未选择":
+            used_cols.append(file_name_col)
+        try:
+            excel_df = load_excel_data(excel_buffer, excel_outline, used_cols, start_row - 1, actual_end_row)
+            st.session_state.excel_clean_timings = {
+                "file_hash": excel_buffer.file_hash,
+                "timings": excel_df.attrs.get(CLEAN_TIMINGS_ATTR, [])
+            }
+        except Exception as e:
+            st.error(f"❌ 读取失败", icon="❌")
+
+    if excel_df is not None:
+        # 模板在任务线程中编译一次，逐行只做槽位拼接
+        batch_task = BatchTask(
+            compiled=None,
+            replace_rules=list(st.session_state.replace_rules),
+            replace_scope=st.session_state.replace_scope,
+            file_name_col=file_name_col if file_name_col != "未选择" else "",
+            file_prefix=file_prefix,
+            merge_only=batch_output == "仅生成合并文档"
+        )
 
-                except Exception as e:
-                    st.session_state.replace_log.append(f"【{row_idx + 1}】❌ 失败")
-                    continue
-
-            st.session_state.replace_params = current_params
-            st.success(f"🎉 完成！{len(st.session_state.replaced_files)} 个文件", icon="✅")
-
-            history_record = HistoryRecord(
-                timestamp=datetime.now().strftime("%m-%d %H:%M"),
-                word_file=word_file.name[:20],
-                excel_file=excel_file.name[:20],
-                rules_count=len(st.session_state.replace_rules),
-                files_generated=len(st.session_state.replaced_files),
-                status="success"
-            )
-            history_manager.add_record(history_record)
+        job = job_manager.submit(
+            word_buffer.data,
+            batch_task,
+            excel_df,
+            list(range(start_row - 1, actual_end_row)),
+            workers=batch_workers if batch_mode == "多进程并行" else 1,
+            chunk_size=batch_chunk_size,
+            params=current_params,
+            meta={
+                "word_file": word_file.name,
+                "excel_file": excel_file.name,
+                "rules_count": len(st.session_state.replace_rules),
+            }
+        )
 
-    except Exception as e:
-        st.error(f"❌ 出错", icon="❌")
-    finally:
-        st.session_state.is_replacing = False
-        progress_bar.empty()
-        progress_text.empty()
+        st.session_state.current_job_id = job.job_id
+        st.session_state.replaced_files = []
+        st.session_state.replace_log = []
+        st.session_state.merged_document_path = ""
+        st.query_params["job"] = job.job_id
+        st.rerun()
 
 st.markdown("---")
 
@@ -1673,18 +1849,31 @@ st.markdown("---")
 if len(st.session_state.replaced_files) > 0:
     st.subheader("💾 下载结果")
 
+    # 结果目录超过保留时间后会被清理，此时提示重新执行，而不是点击下载时报错
+    merged_document_path = st.session_state.merged_document_path
+    valid_files = [f for f in st.session_state.replaced_files if f.is_valid]
+    result_paths = [merged_document_path] if merged_document_path else [f.path for f in valid_files[:1]]
+    results_expired = any(not os.path.exists(path) for path in result_paths)
+    if results_expired:
+        st.warning("⏰ 结果文件已过期清理，请重新执行替换", icon="⚠️")
+
     col_export_opt1, col_export_opt2 = st.columns([2, 2])
 
     with col_export_opt1:
         st.markdown("**导出方式**")
 
-    export_mode = st.radio(
-        "方式",
-        options=["独立文件（ZIP）", "合并为单个文档"],
-        key="export_mode_radio",
-        horizontal=True,
-        label_visibility="collapsed"
-    )
+    # 直接合并模式只生成了合并文档
+    if merged_document_path:
+        export_mode = "合并为单个文档"
+        st.caption("📋 已直接生成合并文档（未生成独立文件）")
+    else:
+        export_mode = st.radio(
+            "方式",
+            options=["独立文件（ZIP）", "合并为单个文档"],
+            key="export_mode_radio",
+            horizontal=True,
+            label_visibility="collapsed"
+        )
 
     st.markdown("---")
 
@@ -1695,8 +1884,7 @@ if len(st.session_state.replaced_files) > 0:
         st.metric("📄 总数", len(st.session_state.replaced_files))
 
     with col_stat2:
-        success_count = len([f for f in st.session_state.replaced_files
-                             if f.data and len(f.data.getvalue()) > 0])
+        success_count = len([f for f in st.session_state.replaced_files if f.is_success])
         st.metric("✅ 成功", success_count)
 
     with col_stat3:
@@ -1711,53 +1899,54 @@ if len(st.session_state.replaced_files) > 0:
     # 导出按钮
     col_down1, col_down2, col_down3 = st.columns(3, gap="small")
 
+    # 导出文件按指纹缓存，只在点击下载时生成，参数或结果变化后自动失效
+    if valid_files:
+        export_fingerprint = get_export_fingerprint(valid_files, st.session_state.replace_params)
+        sync_export_cache(export_fingerprint)
+
     with col_down1:
-        if export_mode == "独立文件（ZIP）":
-            try:
-                valid_files = [f for f in st.session_state.replaced_files
-                               if f.data and len(f.data.getvalue()) > 0]
-
-                if valid_files:
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                        for file in valid_files:
-                            zipf.writestr(file.filename, file.data.getvalue())
-
-                    zip_buffer.seek(0)
-                    zip_filename = f"批量替换_{len(valid_files)}个.zip"
-
-                    st.download_button(
-                        label=f"📦 下载ZIP（{len(valid_files)}个）",
-                        data=zip_buffer,
-                        file_name=zip_filename,
-                        mime="application/zip",
-                        key="download_all_zip",
-                        use_container_width=True,
-                        type="primary",
-                        help=HELP_TEXTS["export_zip"]
-                    )
-            except:
-                st.error("❌ 创建ZIP失败", icon="❌")
-        else:
-            valid_files = [f for f in st.session_state.replaced_files
-                           if f.data and len(f.data.getvalue()) > 0]
+        if merged_document_path:
+            st.download_button(
+                label=f"📋 下载合并文档（{success_count}个）",
+                data=lambda: read_file_bytes(merged_document_path),
+                file_name="合并结果.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key="download_merged_direct",
+                disabled=results_expired,
+                use_container_width=True,
+                type="primary",
+                help=HELP_TEXTS["export_merge"]
+            )
+        elif valid_files and export_mode == "独立文件（ZIP）":
+            zip_path = get_export_path(valid_files, export_fingerprint, "zip")
+            st.session_state.export_cache["artifacts"]["zip"] = zip_path
 
-            if valid_files:
-                try:
-                    merged_data = merge_word_documents(valid_files)
-
-                    st.download_button(
-                        label=f"📋 下载合并文档（{len(valid_files)}个）",
-                        data=merged_data,
-                        file_name="合并结果.docx",
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        key="download_merged",
-                        use_container_width=True,
-                        type="primary",
-                        help=HELP_TEXTS["export_merge"]
-                    )
-                except:
-                    st.error("❌ 合并失败", icon="❌")
+            st.download_button(
+                label=f"📦 下载ZIP（{len(valid_files)}个）",
+                data=lambda: read_export_artifact(valid_files, zip_path, "zip"),
+                file_name=f"批量替换_{len(valid_files)}个.zip",
+                mime="application/zip",
+                key="download_all_zip",
+                disabled=results_expired,
+                use_container_width=True,
+                type="primary",
+                help=HELP_TEXTS["export_zip"]
+            )
+        elif valid_files:
+            merge_path = get_export_path(valid_files, export_fingerprint, "merge")
+            st.session_state.export_cache["artifacts"]["merge"] = merge_path
+
+            st.download_button(
+                label=f"📋 下载合并文档（{len(valid_files)}个）",
+                data=lambda: read_export_artifact(valid_files, merge_path, "merge"),
+                file_name="合并结果.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key="download_merged",
+                disabled=results_expired,
+                use_container_width=True,
+                type="primary",
+                help=HELP_TEXTS["export_merge"]
+            )
 
     with col_down2:
         if st.button("📊 导出统计", key="export_stats", use_container_width=True,
@@ -1815,8 +2004,7 @@ if len(st.session_state.replaced_files) > 0:
     # 文件表格
     file_data = []
     for idx, file in enumerate(current_files, start=start_idx + 1):
-        is_valid = file.data and len(file.data.getvalue()) > 0
-        status = "✅" if is_valid else "❌"
+        status = "✅" if file.is_success else "❌"
         file_data.append({
             "状态": status,
             "序号": idx,
@@ -1833,7 +2021,7 @@ if len(st.session_state.replaced_files) > 0:
     st.markdown("**单个文件下载**")
 
     for idx, file in enumerate(current_files, start=start_idx + 1):
-        is_valid = file.data and len(file.data.getvalue()) > 0
+        is_valid = file.is_valid and not results_expired
 
         col_name, col_log, col_download = st.columns([2, 1, 1], gap="small")
 
@@ -1848,7 +2036,7 @@ if len(st.session_state.replaced_files) > 0:
         with col_download:
             st.download_button(
                 label="⬇️ 下载",
-                data=file.data,
+                data=file.read_bytes if is_valid else b"",
                 file_name=file.filename,
                 mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
                 key=f"download_{idx}",
@@ -1880,8 +2068,8 @@ with st.expander("❓ 帮助指南", expanded=False):
         • 括号：【】（）()〔〕
 
         **文件限制**
-        • Word最大50MB
-        • Excel最大50MB
+        • Word最大200MB
+        • Excel最大200MB
         • 建议行数<1000
         """)
 
@@ -0,0 +1,2400 @@
+"""
+Word+Excel批量替换工具 - 替换引擎
+功能：模板编译、关键字匹配、docx输出和多进程批量执行
+说明：本模块不依赖Streamlit，可在工作进程中直接导入
+"""
+
+# ==================== 导入库 ====================
+import io
+import os
+import re
+import time
+import shutil
+import hashlib
+import tempfile
+import uuid
+import threading
+import struct
+import unicodedata
+import zipfile
+import zlib
+import posixpath
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from lxml import etree
+from docx import Document
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.oxml import OxmlElement
+from docx.opc.part import XmlPart
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.parser import parse_xml
+
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Dict, Tuple, Iterator, Union
+from collections import defaultdict, OrderedDict
+
+# ==================== 配置和常量 ====================
+
+MAX_FILENAME_LENGTH = 200
+MAX_WORD_FILE_SIZE = 200 * 1024 * 1024
+
+# "仅替换括号内内容"时保留的括号
+BRACKET_PAIRS = [("【", "】"), ("（", "）"), ("(", ")"), ("〔", "〕")]
+
+# 多进程批量执行
+DEFAULT_BATCH_WORKERS = os.cpu_count() or 1
+DEFAULT_BATCH_CHUNK_SIZE = 20
+
+# 后台任务：保留的已结束任务数
+MAX_FINISHED_JOBS = 20
+
+# 模板索引缓存：按模板哈希保留的模板数
+TEMPLATE_INDEX_CACHE_SIZE = 8
+
+# 段落渲染缓存的内存上限（可通过环境变量调整，单位MB）
+RENDER_CACHE_BYTES = int(os.environ.get("BATCH_REPLACER_RENDER_CACHE_MB", "64")) * 1024 * 1024
+
+# 结果存储：超过保留时间的任务目录在启动和清理时删除
+RESULT_RETENTION_SECONDS = 24 * 60 * 60
+
+# 导出：流式复制的块大小
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+# docx包结构命名空间和关系类型
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+REL_TYPE_DOCUMENT = REL_NS + "/officeDocument"
+REL_TYPE_NUMBERING = REL_NS + "/numbering"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+# 合并文档时插入的分页段落（与原合并逻辑一致）
+MERGE_PAGE_BREAK = b'<w:p><w:pPr><w:pageBreakBefore w:val="1"/></w:pPr></w:p>'
+MERGE_BODY_MARK = b"<!--MERGE-BODY-->"
+
+# 模板编译常量（槽位标记使用Unicode私有区字符，正常文档不会出现）
+SLOT_MARK_START = "\uF8F0"
+SLOT_MARK_END = "\uF8F1"
+SLOT_MARK_PATTERN = re.compile(f"{SLOT_MARK_START}(\\d+){SLOT_MARK_END}".encode("utf-8"))
+XML_INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+SLOT_BREAK_MARKUP = '</w:t><w:br/><w:t xml:space="preserve">'
+SLOT_TAB_MARKUP = '</w:t><w:tab/><w:t xml:space="preserve">'
+
+# run中表示文字的子元素（与python-docx的Run.text一致）
+RUN_TEXT_XPATH = "w:br | w:cr | w:noBreakHyphen | w:ptab | w:t | w:tab"
+
+# 可以合并的run：只含格式和文字内容
+MERGEABLE_RUN_TAGS = {qn("w:rPr"), qn("w:t"), qn("w:tab"), qn("w:br"), qn("w:cr"), qn("w:noBreakHyphen"), qn("w:ptab")}
+RSID_ATTRIBUTES = [qn("w:rsidR"), qn("w:rsidRPr"), qn("w:rsidDel")]
+
+# 正文之外参与替换的部件（按内容类型）及其显示名称
+WORDML_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml."
+CORE_PROPERTIES_CONTENT_TYPE = "application/vnd.openxmlformats-package.core-properties+xml"
+TEMPLATE_PART_LABELS = {
+    WORDML_CONTENT_TYPE + "header+xml": "页眉",
+    WORDML_CONTENT_TYPE + "footer+xml": "页脚",
+    WORDML_CONTENT_TYPE + "footnotes+xml": "脚注",
+    WORDML_CONTENT_TYPE + "endnotes+xml": "尾注",
+    CORE_PROPERTIES_CONTENT_TYPE: "文档属性",
+}
+
+# ZIP结构常量（与zipfile模块一致）
+ZIP_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+ZIP_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+
+
+# ==================== 数据结构定义 ====================
+
+@dataclass
+class ReplacedFile:
+    """替换后的文件元数据（文件内容保存在结果目录中，按需读取）"""
+    filename: str
+    row_idx: int
+    log: str
+    replace_count: int = 0
+    path: str = ""
+    size: int = 0
+    file_hash: str = ""
+    merged: bool = False
+    fragment: bytes = field(default=b"", repr=False)
+
+    @property
+    def is_valid(self) -> bool:
+        """是否成功生成了文件"""
+        return self.size > 0 and bool(self.path)
+
+    @property
+    def is_success(self) -> bool:
+        """是否生成成功（独立文件，或直接合并模式下已写入合并文档）"""
+        return self.is_valid or (self.merged and self.size > 0)
+
+    def open(self):
+        """以流的方式打开结果文件"""
+        return open(self.path, 'rb')
+
+    def read_bytes(self) -> bytes:
+        """读取结果文件内容（下载单个文件时按需调用）"""
+        with self.open() as f:
+            return f.read()
+
+
+class ResultStore:
+    """
+    磁盘结果存储：每个任务一个目录，文件按行号命名
+
+    只保存文件内容，元数据由ReplacedFile保存。对象只包含目录路径，
+    可以直接传给工作进程，由工作进程写入结果，避免把文件内容传回主进程。
+    """
+
+    def __init__(self, job_dir: str):
+        """初始化结果目录"""
+        self.job_dir = job_dir
+        os.makedirs(self.job_dir, exist_ok=True)
+
+    def save(self, row_idx: int, data: bytes) -> Tuple[str, int, str]:
+        """
+        保存一行的结果文件
+
+        Returns:
+            (文件路径, 文件大小, 文件哈希)
+        """
+        path = os.path.join(self.job_dir, f"{row_idx:07d}.docx")
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path, len(data), hashlib.md5(data).hexdigest()
+
+    @staticmethod
+    def cleanup_expired(root_dir: str, keep_ids: Optional[set] = None,
+                        max_age: float = RESULT_RETENTION_SECONDS):
+        """删除超过保留时间且不在使用中的任务目录"""
+        if not os.path.isdir(root_dir):
+            return
+        now = time.time()
+        for name in os.listdir(root_dir):
+            job_dir = os.path.join(root_dir, name)
+            if keep_ids and name in keep_ids:
+                continue
+            try:
+                if os.path.isdir(job_dir) and now - os.path.getmtime(job_dir) > max_age:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+            except OSError:
+                pass
+
+
+
+# ==================== 核心工具函数 ====================
+
+def clean_text(text: str) -> str:
+    """清理文本：去除首尾空白、隐藏字符、特殊空格，统一格式"""
+    if not isinstance(text, str):
+        return ""
+    text = text.strip()
+    text = unicodedata.normalize("NFKC", text)
+    text = re.sub(r'[\u00A0\u2002-\u200B]', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text
+
+
+def clean_filename(filename: str) -> str:
+    """清理文件名中的非法字符"""
+    return re.sub(r'[\\/:*?"<>|]', "_", str(filename))
+
+
+def format_safe_filename(
+        base_name: str,
+        file_prefix: str = "",
+        file_suffix: str = "",
+        row_idx: int = 0,
+        max_length: int = MAX_FILENAME_LENGTH
+) -> str:
+    """由清理后的文件名主体生成安全文件名，处理超长名称和特殊字符"""
+    try:
+        if not base_name or base_name.isspace():
+            base_name = f"文件_{row_idx + 1}"
+
+        if file_prefix and file_suffix:
+            filename = f"{file_prefix}{base_name}{file_suffix}.docx"
+        elif file_prefix:
+            filename = f"{file_prefix}{base_name}.docx"
+        elif file_suffix:
+            filename = f"{base_name}{file_suffix}.docx"
+        else:
+            filename = f"{base_name}.docx"
+
+        filename = clean_filename(filename)
+
+        filename_bytes = filename.encode('utf-8')
+        if len(filename_bytes) > max_length:
+            truncated_base = base_name
+            while len(f"{file_prefix}{truncated_base}{file_suffix}.docx".encode('utf-8')) > max_length:
+                truncated_base = truncated_base[:-1]
+
+            if file_prefix and file_suffix:
+                filename = f"{file_prefix}{truncated_base}{file_suffix}.docx"
+            elif file_prefix:
+                filename = f"{file_prefix}{truncated_base}.docx"
+            elif file_suffix:
+                filename = f"{truncated_base}{file_suffix}.docx"
+            else:
+                filename = f"{truncated_base}.docx"
+
+            filename = clean_filename(filename)
+
+        return filename
+
+    except:
+        return f"文件_{row_idx + 1}.docx"
+
+
+def get_bracket_wrap(cleaned_text: str, replace_scope: str) -> Tuple[str, str]:
+    """仅替换括号内内容时，返回替换值两侧需要保留的括号"""
+    if replace_scope == "仅替换括号内内容":
+        for left, right in BRACKET_PAIRS:
+            if cleaned_text.startswith(left) and cleaned_text.endswith(right):
+                return left, right
+    return "", ""
+
+
+class KeywordMatcher:
+    """
+    多关键字单遍匹配器（Aho-Corasick自动机）
+
+    由替换模式列表构建一次，之后每段文本只需扫描一遍
+    即可找出所有关键字。重叠命中按"最左优先、同起点最长优先"取舍，替换是
+    同时进行的，因此替换值中出现的关键字不会被其他规则再次匹配。
+    """
+
+    def __init__(self, keywords: List[str]):
+        """
+        构建自动机
+
+        Args:
+            keywords: 关键字列表，重复的关键字以第一次出现的下标为准
+        """
+        self.keywords = keywords
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        seen = set()
+        for pattern_idx, keyword in enumerate(keywords):
+            if not keyword or keyword in seen:
+                continue
+            seen.add(keyword)
+
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(pattern_idx)
+
+        # 按层次构建失败指针，并把失败状态的输出合并进来
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    @classmethod
+    def from_patterns(cls, replace_patterns: List[Tuple[str, str, str, str]]) -> "KeywordMatcher":
+        """从替换模式列表（build_slot_patterns的输出）构建匹配器"""
+        return cls([format_keyword for _, _, format_keyword, _ in replace_patterns])
+
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        查找文本中所有不重叠的关键字命中
+
+        Returns:
+            (起始位置, 结束位置, 关键字下标) 列表，按起始位置排序
+        """
+        goto, fail, output, keywords = self._goto, self._fail, self._output, self.keywords
+        hits = []
+        state = 0
+
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_idx in output[state]:
+                hits.append((pos + 1 - len(keywords[pattern_idx]), pos + 1, pattern_idx))
+
+        if not hits:
+            return hits
+
+        hits.sort(key=lambda hit: (hit[0], hit[0] - hit[1]))
+        selected = []
+        last_end = 0
+        for hit in hits:
+            if hit[0] >= last_end:
+                selected.append(hit)
+                last_end = hit[1]
+        return selected
+
+    def replace(self, text: str, replacements: List[str]) -> Tuple[str, Dict[int, int]]:
+        """
+        一次性替换文本中的所有关键字
+
+        Args:
+            text: 原文本
+            replacements: 与关键字下标对应的替换值
+
+        Returns:
+            (替换后的文本, {关键字下标: 替换次数})
+        """
+        counts = defaultdict(int)
+        hits = self.find_all(text)
+        if not hits:
+            return text, counts
+
+        pieces = []
+        last_end = 0
+        for start, end, pattern_idx in hits:
+            pieces.append(text[last_end:start])
+            pieces.append(replacements[pattern_idx])
+            counts[pattern_idx] += 1
+            last_end = end
+        pieces.append(text[last_end:])
+
+        return "".join(pieces), counts
+
+
+def get_text_atoms(paragraph_element) -> List[Tuple[object, int, int]]:
+    """
+    按顺序列出段落中表示文字的节点及其在段落文本中的起止位置
+
+    节点范围与Paragraph.text一致：段落和超链接中的run，run中的文本、制表符、换行等
+    """
+    atoms = []
+    pos = 0
+    for run in paragraph_element.xpath("w:r | w:hyperlink/w:r"):
+        for element in run.xpath(RUN_TEXT_XPATH):
+            text = (element.text or "") if element.tag == qn("w:t") else str(element)
+            if text:
+                atoms.append((element, pos, pos + len(text)))
+                pos += len(text)
+    return atoms
+
+
+def set_text_node(text_node, text: str):
+    """设置<w:t>的文本，首尾有空白时保留空白"""
+    text_node.text = text
+    if text != text.strip():
+        text_node.set(qn("xml:space"), "preserve")
+
+
+def replace_text_atoms(paragraph_element, hits: List[Tuple[int, int, int]], replacements: List[str]):
+    """
+    只改写与命中位置重叠的文字节点
+
+    替换值写入命中起点所在的<w:t>（沿用该run的格式），命中范围内的其他文字节点
+    删除或截去被覆盖的部分，其余run和节点保持不变。命中从后往前处理，前面节点
+    的位置不受影响。
+    """
+    atoms = get_text_atoms(paragraph_element)
+
+    for start, end, pattern_idx in reversed(hits):
+        overlapping = [atom for atom in atoms if atom[1] < end and atom[2] > start]
+        if not overlapping:
+            continue
+
+        first, first_start, first_end = overlapping[0]
+        if first.tag == qn("w:t"):
+            text = first.text or ""
+            tail = text[end - first_start:] if first_end >= end else ""
+            set_text_node(first, text[:start - first_start] + replacements[pattern_idx] + tail)
+            covered = overlapping[1:]
+        else:
+            # 命中以非文本节点开头（如不换行连字符），在其前插入文本节点
+            text_node = OxmlElement("w:t")
+            set_text_node(text_node, replacements[pattern_idx])
+            first.addprevious(text_node)
+            covered = overlapping
+
+        for element, atom_start, atom_end in covered:
+            if atom_end > end and element.tag == qn("w:t"):
+                set_text_node(element, (element.text or "")[end - atom_start:])
+            elif atom_end <= end:
+                element.getparent().remove(element)
+
+
+def is_mergeable_run(run, other) -> bool:
+    """两个run格式相同且只含文字内容时可以合并"""
+    if any(child.tag not in MERGEABLE_RUN_TAGS for child in run) or \
+            any(child.tag not in MERGEABLE_RUN_TAGS for child in other):
+        return False
+    run_props, other_props = run.find(qn("w:rPr")), other.find(qn("w:rPr"))
+    if run_props is None or other_props is None:
+        return run_props is None and other_props is None
+    return etree.tostring(run_props) == etree.tostring(other_props)
+
+
+def merge_text_nodes(run):
+    """合并run中相邻的<w:t>"""
+    previous = None
+    for child in list(run):
+        if child.tag == qn("w:t") and previous is not None and previous.tag == qn("w:t"):
+            set_text_node(previous, (previous.text or "") + (child.text or ""))
+            run.remove(child)
+        else:
+            previous = child
+
+
+def normalize_keyword_runs(paragraph_element, hits: List[Tuple[int, int, int]]) -> int:
+    """
+    模板规范化：关键字跨越多个run时，删除其间的拼写检查标记，并合并格式相同的相邻run
+
+    Word常把一个关键字拆成多个run（拼写检查标记、修订标识rsid不同等），合并后关键字
+    成为单个run中的文本，替换时只需改写一个节点。段落文本不变。
+
+    Returns:
+        合并掉的run数
+    """
+    merged = 0
+
+    for start, end, _ in hits:
+        runs = []
+        for element, atom_start, atom_end in get_text_atoms(paragraph_element):
+            if atom_start < end and atom_end > start and element.getparent() not in runs:
+                runs.append(element.getparent())
+        if len(runs) < 2 or runs[0].getparent() is not runs[-1].getparent():
+            continue
+
+        # 关键字范围内的兄弟节点
+        siblings = []
+        node = runs[0]
+        while node is not None:
+            siblings.append(node)
+            if node is runs[-1]:
+                break
+            node = node.getnext()
+        if node is None:
+            continue
+
+        for node in siblings:
+            if node.tag == qn("w:proofErr"):
+                node.getparent().remove(node)
+
+        for run in [node for node in siblings if node.tag == qn("w:r")][1:]:
+            previous = run.getprevious()
+            if previous is None or previous.tag != qn("w:r") or not is_mergeable_run(previous, run):
+                continue
+            for child in list(run):
+                if child.tag != qn("w:rPr"):
+                    previous.append(child)
+            run.getparent().remove(run)
+            for attribute in RSID_ATTRIBUTES:
+                previous.attrib.pop(attribute, None)
+            merge_text_nodes(previous)
+            merged += 1
+
+    return merged
+
+
+def process_paragraph(
+        paragraph,
+        replace_patterns: List[Tuple[str, str, str, str]],
+        matcher: Optional[KeywordMatcher] = None
+) -> Dict:
+    """处理单个段落的关键字替换（单遍匹配，所有规则同时替换，只改写命中所在的run）"""
+    para_text = paragraph.text
+    replace_count = defaultdict(int)
+
+    if not para_text or not replace_patterns:
+        return replace_count
+
+    if matcher is None:
+        matcher = KeywordMatcher.from_patterns(replace_patterns)
+
+    hits = matcher.find_all(para_text)
+
+    if hits:
+        for _, _, pattern_idx in hits:
+            old_text, col_name, _, _ = replace_patterns[pattern_idx]
+            replace_count[(old_text, col_name)] += 1
+
+        normalize_keyword_runs(paragraph._p, hits)
+        replace_text_atoms(paragraph._p, hits, [replacement for _, _, _, replacement in replace_patterns])
+
+    return replace_count
+
+
+def make_slot_marker(slot: int) -> str:
+    """生成模板编译用的槽位标记（私有区字符包裹槽位序号）"""
+    return f"{SLOT_MARK_START}{slot}{SLOT_MARK_END}"
+
+
+def build_slot_patterns(replace_rules: List[Tuple[str, str]]) -> List[Tuple[str, str, str, str]]:
+    """
+    生成编译模板用的替换模式：关键字替换为槽位标记
+
+    槽位序号按规则中非空关键字的顺序编号，与替换值矩阵的列一一对应
+    """
+    slot_patterns = []
+
+    for old_text, col_name in replace_rules:
+        cleaned_text = clean_text(old_text)
+        if not cleaned_text:
+            continue
+        slot_patterns.append((old_text, col_name, cleaned_text, make_slot_marker(len(slot_patterns))))
+
+    return slot_patterns
+
+
+def escape_slot_value(value: str) -> bytes:
+    """将替换值转义为可直接拼接进<w:t>的XML字节（换行、制表符转为对应元素）"""
+    value = XML_INVALID_CHARS.sub("", value)
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    value = value.replace("\r\n", "\n").replace("\r", "\n")
+    value = value.replace("\n", SLOT_BREAK_MARKUP)
+    value = value.replace("\t", SLOT_TAB_MARKUP)
+    return value.encode("utf-8")
+
+
+def to_plain_slot_value(escaped: bytes) -> bytes:
+    """把escape_slot_value的结果还原为普通XML文本（用于不含<w:t>的部件，如文档属性）"""
+    return escaped.replace(SLOT_BREAK_MARKUP.encode("utf-8"), b"\n").replace(SLOT_TAB_MARKUP.encode("utf-8"), b"\t")
+
+
+@dataclass
+class PackageMember:
+    """docx压缩包中的一个成员，保存原始压缩流，输出时按字节直接复制"""
+    filename: str
+    name_bytes: bytes
+    flag_bits: int
+    compress_type: int
+    dos_time: int
+    dos_date: int
+    crc: int
+    compress_size: int
+    file_size: int
+    external_attr: int
+    raw_data: bytes
+
+
+def read_package_members(template_bytes: bytes) -> List[PackageMember]:
+    """
+    读取模板压缩包中所有成员的原始压缩流（只打开一次）
+
+    Args:
+        template_bytes: docx文件内容
+
+    Returns:
+        成员列表，顺序与原压缩包一致
+    """
+    members = []
+    buffer = memoryview(template_bytes)
+
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as template_zip:
+        for info in template_zip.infolist():
+            if info.flag_bits & 0x1:
+                raise ValueError("不支持加密的文件")
+
+            header = ZIP_LOCAL_HEADER.unpack_from(buffer, info.header_offset)
+            data_start = info.header_offset + ZIP_LOCAL_HEADER.size + header[10] + header[11]
+
+            try:
+                name_bytes = info.filename.encode("ascii")
+                flag_bits = info.flag_bits & ~0x808
+            except UnicodeEncodeError:
+                name_bytes = info.filename.encode("utf-8")
+                flag_bits = (info.flag_bits & ~0x8) | 0x800
+
+            year, month, day, hour, minute, second = info.date_time
+            members.append(PackageMember(
+                filename=info.filename,
+                name_bytes=name_bytes,
+                flag_bits=flag_bits,
+                compress_type=info.compress_type,
+                dos_time=(hour << 11) | (minute << 5) | (second // 2),
+                dos_date=((year - 1980) << 9) | (month << 5) | day,
+                crc=info.CRC,
+                compress_size=info.compress_size,
+                file_size=info.file_size,
+                external_attr=info.external_attr,
+                raw_data=bytes(buffer[data_start:data_start + info.compress_size])
+            ))
+
+    return members
+
+
+@dataclass
+class DeflatedChunk:
+    """一段XML及其独立压缩的deflate数据（以同步标记结尾，可与其他块直接拼接）"""
+    raw: bytes
+    data: bytes
+
+
+@dataclass
+class RenderedPart:
+    """已压缩的部件内容：可直接写入压缩包"""
+    crc: int
+    file_size: int
+    data: bytes
+
+
+# deflate流的结束块（空的最终块）
+DEFLATE_FINAL_BLOCK = b"\x03\x00"
+
+
+def deflate_chunk(raw: bytes) -> DeflatedChunk:
+    """独立压缩一段数据，以同步标记结尾，多个块按顺序拼接后仍是合法的deflate流"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return DeflatedChunk(raw=raw, data=compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def join_deflated_chunks(chunks: List[DeflatedChunk]) -> RenderedPart:
+    """拼接压缩块并补上结束块"""
+    crc = 0
+    file_size = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk.raw, crc)
+        file_size += len(chunk.raw)
+    return RenderedPart(crc=crc, file_size=file_size,
+                        data=b"".join(chunk.data for chunk in chunks) + DEFLATE_FINAL_BLOCK)
+
+
+def write_docx_package(
+        members: List[PackageMember],
+        replaced_parts: Dict[str, Union[bytes, RenderedPart]],
+        output
+) -> None:
+    """
+    写出docx压缩包：只压缩被改写的XML部件，其余成员直接复制原始压缩流
+
+    Args:
+        members: 模板成员列表
+        replaced_parts: {成员名: 新内容或已压缩的内容}，只包含需要改写的部件
+        output: 可写的二进制文件对象
+    """
+    central_entries = []
+    offset = 0
+
+    for member in members:
+        data = replaced_parts.get(member.filename)
+        if isinstance(data, RenderedPart):
+            raw_data = data.data
+            compress_type = zipfile.ZIP_DEFLATED
+            crc = data.crc
+            file_size = data.file_size
+        elif data is not None:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            raw_data = compressor.compress(data) + compressor.flush()
+            compress_type = zipfile.ZIP_DEFLATED
+            crc = zlib.crc32(data)
+            file_size = len(data)
+        else:
+            raw_data = member.raw_data
+            compress_type = member.compress_type
+            crc = member.crc
+            file_size = member.file_size
+
+        if len(raw_data) > 0xFFFFFFFF or file_size > 0xFFFFFFFF or offset > 0xFFFFFFFF:
+            raise ValueError("文件过大")
+
+        extract_version = 20 if compress_type == zipfile.ZIP_DEFLATED else 10
+        output.write(ZIP_LOCAL_HEADER.pack(
+            b"PK\x03\x04", extract_version, 0, member.flag_bits, compress_type,
+            member.dos_time, member.dos_date, crc, len(raw_data), file_size,
+            len(member.name_bytes), 0
+        ))
+        output.write(member.name_bytes)
+        output.write(raw_data)
+
+        central_entries.append(ZIP_CENTRAL_HEADER.pack(
+            b"PK\x01\x02", 20, 0, extract_version, 0, member.flag_bits, compress_type,
+            member.dos_time, member.dos_date, crc, len(raw_data), file_size,
+            len(member.name_bytes), 0, 0, 0, 0, member.external_attr, offset
+        ) + member.name_bytes)
+
+        offset += ZIP_LOCAL_HEADER.size + len(member.name_bytes) + len(raw_data)
+
+    central_dir = b"".join(central_entries)
+    output.write(central_dir)
+    output.write(ZIP_END_RECORD.pack(
+        b"PK\x05\x06", 0, 0, len(central_entries), len(central_entries),
+        len(central_dir), offset, 0
+    ))
+
+
+# ==================== 模板索引 ====================
+
+@dataclass
+class IndexedParagraph:
+    """模板中的一个段落：位置和原文"""
+    path: str
+    location: str
+    text: str
+
+
+@dataclass
+class TemplateIndex:
+    """
+    模板段落索引（每个模板只建立一次）
+
+    按文档顺序记录正文、表格、嵌套表格和文本框中每个非空段落的元素路径和文本，
+    编译模板或预览时只需在缓存的文本上查找关键字，再按路径直接定位到
+    包含关键字的段落，不必遍历和读取全部段落。
+    """
+    template_hash: str
+    paragraphs: List[IndexedParagraph]
+
+    def locate(self, matcher: "KeywordMatcher") -> List[Tuple[IndexedParagraph, Dict[int, int]]]:
+        """
+        查找包含关键字的段落
+
+        Returns:
+            [(段落, {关键字下标: 命中次数})]
+        """
+        located = []
+        for paragraph in self.paragraphs:
+            hits = defaultdict(int)
+            for _, _, idx in matcher.find_all(paragraph.text):
+                hits[idx] += 1
+            if hits:
+                located.append((paragraph, dict(hits)))
+        return located
+
+
+def iter_table_paragraphs(table_element, location: str = "表格") -> Iterator[Tuple[object, str]]:
+    """
+    直接遍历表格XML中的段落（w:tr → w:tc → w:p），嵌套表格递归处理
+
+    每个w:tc元素只访问一次，横向或纵向合并的单元格不会像row.cells那样被重复返回
+    """
+    for row in table_element.iterchildren(qn("w:tr")):
+        for cell in row.iterchildren(qn("w:tc")):
+            for child in cell:
+                if child.tag == qn("w:p"):
+                    yield child, location
+                elif child.tag == qn("w:tbl"):
+                    yield from iter_table_paragraphs(child, "嵌套表格")
+
+
+def iter_template_paragraphs(doc) -> Iterator[Tuple[object, str]]:
+    """按文档顺序遍历正文段落和表格（含嵌套表格）中的段落元素，最后是文本框中的段落"""
+    for child in doc.element.body:
+        if child.tag == qn("w:p"):
+            yield child, "正文"
+        elif child.tag == qn("w:tbl"):
+            yield from iter_table_paragraphs(child)
+
+    seen = set()
+    for text_box in doc.element.body.iter(qn("w:txbxContent")):
+        for element in text_box.iter(qn("w:p")):
+            if element not in seen:
+                seen.add(element)
+                yield element, "文本框"
+
+
+def build_template_index(doc, template_hash: str = "") -> TemplateIndex:
+    """为已解析的模板建立段落索引"""
+    root_tree = doc.element.getroottree()
+    paragraphs = []
+
+    for element, location in iter_template_paragraphs(doc):
+        text = element.text
+        if not text:
+            continue
+        paragraphs.append(IndexedParagraph(
+            path=root_tree.getelementpath(element),
+            location=location,
+            text=text
+        ))
+
+    return TemplateIndex(template_hash=template_hash, paragraphs=paragraphs)
+
+
+_template_index_cache: "OrderedDict[str, TemplateIndex]" = OrderedDict()
+_template_index_lock = threading.Lock()
+
+
+def get_template_index(template_bytes: bytes, doc=None) -> TemplateIndex:
+    """
+    获取模板段落索引（按模板内容哈希缓存，最近使用的保留TEMPLATE_INDEX_CACHE_SIZE个）
+
+    Args:
+        template_bytes: Word模板文件内容
+        doc: 已解析的模板（未命中缓存时用于建立索引，省去再次解析）
+
+    Returns:
+        模板段落索引
+    """
+    template_hash = hashlib.md5(template_bytes).hexdigest()
+
+    with _template_index_lock:
+        index = _template_index_cache.get(template_hash)
+        if index is not None:
+            _template_index_cache.move_to_end(template_hash)
+            return index
+
+    index = build_template_index(doc if doc is not None else Document(io.BytesIO(template_bytes)), template_hash)
+
+    with _template_index_lock:
+        _template_index_cache[template_hash] = index
+        while len(_template_index_cache) > TEMPLATE_INDEX_CACHE_SIZE:
+            _template_index_cache.popitem(last=False)
+
+    return index
+
+
+# ==================== 渲染缓存 ====================
+
+# 段落结束标记：按段落边界拆分部件
+PARAGRAPH_END = b"</w:p>"
+
+
+@dataclass
+class RenderRegion:
+    """部件中包含槽位的一段（从段落开始到段落结束），按替换值缓存渲染结果"""
+    region_id: int
+    segments: List[bytes]
+    slots: List[int]
+
+
+def build_render_pieces(segments: List[bytes], slots: List[int]) -> List[Union[DeflatedChunk, RenderRegion]]:
+    """
+    把按槽位拆分的部件再按段落边界分为静态块和含槽位的区域
+
+    静态块在编译时压缩一次；含槽位的区域从所在段落开始到段落结束，相邻槽位
+    之间没有段落结束时属于同一区域。
+    """
+    pieces = []
+
+    def add_static(raw: bytes):
+        if raw:
+            pieces.append(deflate_chunk(raw))
+
+    if not slots:
+        add_static(segments[0])
+        return pieces
+
+    cut = segments[0].rfind(PARAGRAPH_END)
+    cut = cut + len(PARAGRAPH_END) if cut >= 0 else 0
+    add_static(segments[0][:cut])
+    region_segments, region_slots = [segments[0][cut:]], []
+
+    for k, slot in enumerate(slots):
+        region_slots.append(slot)
+        following = segments[k + 1]
+        end = following.find(PARAGRAPH_END)
+
+        if k < len(slots) - 1 and end < 0:
+            region_segments.append(following)
+            continue
+
+        tail_end = end + len(PARAGRAPH_END) if end >= 0 else len(following)
+        region_segments.append(following[:tail_end])
+        pieces.append(RenderRegion(region_id=len(pieces), segments=region_segments, slots=region_slots))
+
+        if k == len(slots) - 1:
+            add_static(following[tail_end:])
+        else:
+            head_start = following.rfind(PARAGRAPH_END) + len(PARAGRAPH_END)
+            add_static(following[tail_end:head_start])
+            region_segments, region_slots = [following[head_start:]], []
+
+    return pieces
+
+
+class RenderCache:
+    """
+    段落渲染的LRU缓存，按占用字节数限制大小
+
+    键为(模板编号, 区域编号, 区域内的替换值)，值为渲染并压缩后的区域。部门、地址、
+    签字人等取值重复的列会让同一段落反复得到相同结果，命中后直接复用。
+    """
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[tuple, DeflatedChunk]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _item_size(key: tuple, chunk: DeflatedChunk) -> int:
+        return len(chunk.raw) + len(chunk.data) + sum(len(value) for value in key[2]) + 64
+
+    def get(self, key: tuple) -> Optional[DeflatedChunk]:
+        with self._lock:
+            chunk = self._items.get(key)
+            if chunk is not None:
+                self._items.move_to_end(key)
+            return chunk
+
+    def put(self, key: tuple, chunk: DeflatedChunk):
+        item_size = self._item_size(key, chunk)
+        if item_size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = chunk
+            self.size += item_size
+            while self.size > self.max_bytes:
+                old_key, old_chunk = self._items.popitem(last=False)
+                self.size -= self._item_size(old_key, old_chunk)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+# 当前进程的渲染缓存（多进程时每个工作进程各有一份）
+_render_cache = RenderCache()
+
+
+def render_pieces(
+        cache_key: str,
+        pieces: List[Union[DeflatedChunk, RenderRegion]],
+        escaped: List[bytes],
+        cache: Optional[RenderCache] = None
+) -> RenderedPart:
+    """按替换值渲染部件：静态块直接复用，含槽位的区域先查缓存，未命中时渲染并压缩"""
+    cache = _render_cache if cache is None else cache
+    chunks = []
+
+    for piece in pieces:
+        if isinstance(piece, DeflatedChunk):
+            chunks.append(piece)
+            continue
+
+        values = tuple(escaped[slot] for slot in piece.slots)
+        key = (cache_key, piece.region_id, values)
+        chunk = cache.get(key)
+        if chunk is None:
+            chunk = deflate_chunk(render_slots(piece.segments, list(range(len(values))), list(values)))
+            cache.put(key, chunk)
+        chunks.append(chunk)
+
+    return join_deflated_chunks(chunks)
+
+
+@dataclass
+class CompiledPart:
+    """正文之外含关键字的部件（页眉、页脚、脚注、尾注、文档属性），同样拆分为片段和槽位"""
+    name: str
+    label: str
+    segments: List[bytes]
+    slots: List[int]
+    plain_text: bool = False
+    pieces: List[Union[DeflatedChunk, RenderRegion]] = field(default_factory=list)
+
+
+@dataclass
+class CompiledTemplate:
+    """编译后的Word模板：document.xml拆分为静态字节片段和关键字槽位"""
+    members: List[PackageMember]
+    document_name: str
+    segments: List[bytes]
+    slots: List[int]
+    replace_log: str
+    total_replace: int
+    parts: List[CompiledPart] = field(default_factory=list)
+    part_counts: Dict[str, int] = field(default_factory=dict)
+    pieces: List[Union[DeflatedChunk, RenderRegion]] = field(default_factory=list)
+    cache_key: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+def mark_slot_text_nodes(root):
+    """含槽位的文本节点必须保留空白，否则替换值两侧的空格会被Word忽略"""
+    for text_node in root.iter(qn("w:t")):
+        if text_node.text and SLOT_MARK_START in text_node.text:
+            text_node.set(qn("xml:space"), "preserve")
+
+
+def is_fallback_content(element) -> bool:
+    """
+    段落是否位于mc:Fallback中
+
+    DrawingML文本框在mc:Choice和mc:Fallback（VML副本）中各有一份，两份都替换，
+    替换次数只统计mc:Choice中的一份
+    """
+    return next(element.iterancestors(MC_FALLBACK), None) is not None
+
+
+def compile_wordml_part(root, slot_patterns: List[Tuple[str, str, str, str]], matcher: KeywordMatcher) -> Dict:
+    """单次遍历页眉、页脚、脚注等部件中的全部段落（含表格和文本框），关键字替换为槽位标记"""
+    replace_count = defaultdict(int)
+
+    for element in list(root.iter(qn("w:p"))):
+        if not element.text:
+            continue
+        para_count = process_paragraph(Paragraph(element, None), slot_patterns, matcher)
+        if is_fallback_content(element):
+            continue
+        for key, count in para_count.items():
+            replace_count[key] += count
+
+    mark_slot_text_nodes(root)
+    return replace_count
+
+
+def compile_core_properties(root, slot_patterns: List[Tuple[str, str, str, str]], matcher: KeywordMatcher) -> Dict:
+    """文档属性（标题、主题、关键词等）的关键字替换为槽位标记"""
+    replace_count = defaultdict(int)
+    markers = [replacement for _, _, _, replacement in slot_patterns]
+
+    for element in root:
+        if not element.text or len(element):
+            continue
+        new_text, counts = matcher.replace(element.text, markers)
+        if counts:
+            element.text = new_text
+            for pattern_idx, count in counts.items():
+                old_text, col_name, _, _ = slot_patterns[pattern_idx]
+                replace_count[(old_text, col_name)] += count
+
+    return replace_count
+
+
+def compile_word_template(
+        template_bytes: bytes,
+        replace_rules: List[Tuple[str, str]]
+) -> CompiledTemplate:
+    """
+    编译Word模板（每批次只解析一次）
+
+    通过模板段落索引只处理包含关键字的段落（正文、表格、嵌套表格和文本框），
+    关键字替换为槽位标记，然后把document.xml按槽位拆分成静态字节片段。页眉、
+    页脚、脚注、尾注和文档属性每个部件只遍历一次，含关键字的部件同样拆分。
+    逐行生成时只需把转义后的替换值拼接进槽位。
+
+    Args:
+        template_bytes: Word模板文件内容
+        replace_rules: 替换规则列表
+
+    Returns:
+        编译后的模板
+    """
+    if len(template_bytes) > MAX_WORD_FILE_SIZE:
+        raise ValueError("文件过大")
+
+    doc = Document(io.BytesIO(template_bytes))
+    if SLOT_MARK_START.encode("utf-8") in doc.part.blob:
+        raise ValueError("模板包含保留字符")
+
+    slot_patterns = build_slot_patterns(replace_rules)
+
+    document_name = doc.part.partname.lstrip("/")
+    replace_count = defaultdict(int)
+    part_counts = {}
+    compiled_parts = []
+
+    if slot_patterns:
+        matcher = KeywordMatcher.from_patterns(slot_patterns)
+        index = get_template_index(template_bytes, doc)
+
+        # 先按索引路径定位全部段落再处理：合并run会改变兄弟节点的序号，
+        # 同一段落后面run中的文本框路径会失效
+        elements = [doc.element.find(indexed.path) for indexed, _ in index.locate(matcher)]
+
+        document_count = 0
+        for element in elements:
+            if element is None:
+                continue
+            para_count = process_paragraph(Paragraph(element, doc._body), slot_patterns, matcher)
+            if is_fallback_content(element):
+                continue
+            for key, count in para_count.items():
+                replace_count[key] += count
+                document_count += count
+
+        mark_slot_text_nodes(doc.element)
+        if document_count:
+            part_counts[document_name] = document_count
+
+        for part in doc.part.package.iter_parts():
+            label = TEMPLATE_PART_LABELS.get(part.content_type)
+            if label is None:
+                continue
+            if SLOT_MARK_START.encode("utf-8") in part.blob:
+                raise ValueError("模板包含保留字符")
+
+            root = part.element if isinstance(part, XmlPart) else parse_xml(part.blob)
+            plain_text = part.content_type == CORE_PROPERTIES_CONTENT_TYPE
+            if plain_text:
+                counts = compile_core_properties(root, slot_patterns, matcher)
+            else:
+                counts = compile_wordml_part(root, slot_patterns, matcher)
+            if not counts:
+                continue
+
+            part_name = part.partname.lstrip("/")
+            pieces = SLOT_MARK_PATTERN.split(serialize_part_xml(root))
+            part_segments, part_slots = pieces[0::2], [int(slot) for slot in pieces[1::2]]
+            compiled_parts.append(CompiledPart(
+                name=part_name,
+                label=label,
+                segments=part_segments,
+                slots=part_slots,
+                plain_text=plain_text,
+                pieces=build_render_pieces(part_segments, part_slots)
+            ))
+            part_counts[part_name] = sum(counts.values())
+            for key, count in counts.items():
+                replace_count[key] += count
+
+    total_replace = sum(part_counts.values())
+
+    if not slot_patterns:
+        replace_log = "⚠ 未找到匹配规则"
+    elif replace_count:
+        log_lines = [f"✓ {old}" for old, _ in replace_count.keys()]
+        replace_log = ", ".join(log_lines[:3])
+        if len(replace_count) > 3:
+            replace_log += f" 等{len(replace_count) - 3}个"
+    else:
+        replace_log = "⚠ 无替换"
+
+    # 正文之外的替换按部件类型汇总
+    label_counts = defaultdict(int)
+    for part in compiled_parts:
+        label_counts[part.label] += part_counts[part.name]
+    if label_counts:
+        replace_log += " | " + ", ".join(f"{label}{count}处" for label, count in label_counts.items())
+
+    pieces = SLOT_MARK_PATTERN.split(doc.part.blob)
+    segments, slots = pieces[0::2], [int(slot) for slot in pieces[1::2]]
+
+    return CompiledTemplate(
+        members=read_package_members(template_bytes),
+        document_name=document_name,
+        segments=segments,
+        slots=slots,
+        pieces=build_render_pieces(segments, slots),
+        replace_log=replace_log,
+        total_replace=total_replace,
+        parts=compiled_parts,
+        part_counts=part_counts
+    )
+
+
+def render_slots(segments: List[bytes], slots: List[int], escaped: List[bytes]) -> bytes:
+    """把转义后的替换值依次拼接进静态片段之间的槽位"""
+    chunks = [segments[0]]
+    for slot, segment in zip(slots, segments[1:]):
+        chunks.append(escaped[slot])
+        chunks.append(segment)
+    return b"".join(chunks)
+
+
+def render_compiled_parts(
+        compiled: CompiledTemplate,
+        escaped: List[bytes],
+        deflated: bool = False
+) -> Dict[str, Union[bytes, RenderedPart]]:
+    """
+    渲染正文之外含关键字的部件
+
+    Args:
+        compiled: 编译后的模板
+        escaped: 转义后的替换值
+        deflated: 为True时返回经渲染缓存压缩好的内容，否则返回XML字节
+
+    Returns:
+        {成员名: 新内容}
+    """
+    rendered = {}
+    plain_values = None
+
+    for part in compiled.parts:
+        values = escaped
+        if part.plain_text:
+            if plain_values is None:
+                plain_values = [to_plain_slot_value(value) for value in escaped]
+            values = plain_values
+        if deflated:
+            rendered[part.name] = render_pieces(f"{compiled.cache_key}:{part.name}", part.pieces, values)
+        else:
+            rendered[part.name] = render_slots(part.segments, part.slots, values)
+
+    return rendered
+
+
+def render_compiled_values(
+        compiled: CompiledTemplate,
+        escaped: List[bytes]
+) -> io.BytesIO:
+    """把已转义的替换值拼接进编译模板的槽位，生成完整的docx文件（段落渲染结果按替换值缓存）"""
+    replaced_parts = render_compiled_parts(compiled, escaped, deflated=True)
+    replaced_parts[compiled.document_name] = render_pieces(compiled.cache_key, compiled.pieces, escaped)
+
+    output_file = io.BytesIO()
+    write_docx_package(compiled.members, replaced_parts, output_file)
+    output_file.seek(0)
+    return output_file
+
+
+# ==================== 直接合并 ====================
+
+@dataclass
+class MergeLayout:
+    """直接合并模式下的模板布局：正文之前、按槽位拆分的正文、正文之后（含最后的节属性）"""
+    head: bytes
+    segments: List[bytes]
+    slots: List[int]
+    tail: bytes
+
+
+def build_merge_layout(compiled: CompiledTemplate) -> MergeLayout:
+    """
+    从编译模板中拆出正文部分
+
+    正文开始于<w:body>之后，结束于正文最后的节属性（没有节属性时为</w:body>）之前；
+    槽位都在正文段落中，因此只需调整首尾两个片段。
+    """
+    segments = list(compiled.segments)
+
+    first = segments[0]
+    body_pos = first.find(b"<w:body")
+    if body_pos < 0:
+        raise ValueError("模板缺少正文")
+    body_start = first.index(b">", body_pos) + 1
+    head = first[:body_start]
+    segments[0] = first[body_start:]
+
+    last = segments[-1]
+    body_end = last.rfind(b"</w:body>")
+    if body_end < 0:
+        raise ValueError("模板缺少正文")
+
+    block_end = max(last.rfind(b"</w:p>", 0, body_end), last.rfind(b"</w:tbl>", 0, body_end),
+                    last.rfind(b"</w:sdt>", 0, body_end))
+    sect_match = re.compile(rb"<w:sectPr[\s>]").search(last, max(block_end, 0), body_end)
+    split = sect_match.start() if sect_match else body_end
+
+    segments[-1] = last[:split]
+    return MergeLayout(head=head, segments=segments, slots=list(compiled.slots), tail=last[split:])
+
+
+class MergedDocumentWriter:
+    """
+    直接合并模式的输出：逐行把渲染后的正文写入同一个document.xml流
+
+    样式、编号、图片等部件来自模板，只写一次；行与行之间插入与合并导出
+    相同的分页段落。页眉、页脚等部件与合并导出一样取第一行的内容。
+    先写临时文件，完成后再替换为正式文件。
+    """
+
+    def __init__(
+            self,
+            compiled: CompiledTemplate,
+            layout: MergeLayout,
+            output_path: str,
+            part_values: Optional[List[bytes]] = None
+    ):
+        """
+        打开输出文件并写入document.xml之前的模板成员
+
+        Args:
+            compiled: 编译后的模板
+            layout: 正文布局
+            output_path: 合并文档保存路径
+            part_values: 渲染页眉、页脚等部件用的替换值（第一行）
+        """
+        self.compiled = compiled
+        self.layout = layout
+        self.output_path = output_path
+        self.count = 0
+        self.rendered_parts = render_compiled_parts(compiled, part_values) if part_values is not None else {}
+
+        output_dir = os.path.dirname(output_path)
+        os.makedirs(output_dir, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=output_dir, suffix=".tmp")
+        os.close(fd)
+
+        self._zip = zipfile.ZipFile(self.temp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        names = [member.filename for member in compiled.members]
+        self._document_pos = names.index(compiled.document_name)
+        for member in compiled.members[:self._document_pos]:
+            self._write_member(member)
+
+        self._document = self._zip.open(compiled.document_name, 'w', force_zip64=True)
+        self._document.write(layout.head)
+
+    def _write_member(self, member: PackageMember):
+        """写入一个模板成员（含关键字的部件写入渲染后的内容）"""
+        data = self.rendered_parts.get(member.filename)
+        if data is None:
+            data = member.raw_data
+            if member.compress_type == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -15)
+        self._zip.writestr(member.filename, data)
+
+    def append(self, fragment: bytes):
+        """追加一行的正文（第一行之后的每行前插入分页段落）"""
+        if self.count > 0:
+            self._document.write(MERGE_PAGE_BREAK)
+        self._document.write(fragment)
+        self.count += 1
+
+    def close(self) -> str:
+        """写入正文之后的部分和其余成员，返回合并文档路径"""
+        self._document.write(self.layout.tail)
+        self._document.close()
+        for member in self.compiled.members[self._document_pos + 1:]:
+            self._write_member(member)
+        self._zip.close()
+
+        os.replace(self.temp_path, self.output_path)
+        return self.output_path
+
+    def abort(self):
+        """放弃输出并删除临时文件"""
+        try:
+            self._document.close()
+            self._zip.close()
+        except Exception:
+            pass
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+# ==================== 批量预计算 ====================
+
+@dataclass
+class EncodedColumn:
+    """
+    按编码存储的一列替换值
+
+    values为去重后的替换值（每个只转义一次），codes为每行替换值在values中的位置；
+    内存与唯一值数量成正比，编码相同即替换值相同。
+    """
+    codes: np.ndarray
+    values: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, pos: int) -> bytes:
+        return self.values[self.codes[pos]]
+
+    def take(self, positions) -> "EncodedColumn":
+        """按位置（切片或位置列表）取出若干行，只保留这些行用到的替换值"""
+        used, codes = np.unique(self.codes[positions], return_inverse=True)
+        return EncodedColumn(codes=codes.ravel(), values=self.values[used])
+
+
+@dataclass
+class ReplacementMatrix:
+    """
+    批量预计算的替换值矩阵
+
+    每个替换模式一列（与编译模板的槽位序号一一对应），值已完成去空白、
+    括号包裹和XML转义；逐行生成时只需按位置取值。
+    """
+    row_indices: List[int]
+    columns: List[EncodedColumn]
+    filenames: List[str]
+
+    def __len__(self) -> int:
+        return len(self.row_indices)
+
+    def row_values(self, pos: int) -> List[bytes]:
+        """第pos行（在矩阵中的位置）的转义替换值"""
+        return [column[pos] for column in self.columns]
+
+    def _take_columns(self, positions) -> List[EncodedColumn]:
+        """按位置取出各列（多条规则共用的列只处理一次，结果仍然共用）"""
+        taken = {}
+        for column in self.columns:
+            if id(column) not in taken:
+                taken[id(column)] = column.take(positions)
+        return [taken[id(column)] for column in self.columns]
+
+    def slice(self, start: int, stop: int) -> "ReplacementMatrix":
+        """截取连续的若干行（用于分块发送给工作进程，每块只携带自己用到的替换值）"""
+        return ReplacementMatrix(
+            row_indices=self.row_indices[start:stop],
+            columns=self._take_columns(slice(start, stop)),
+            filenames=self.filenames[start:stop]
+        )
+
+    def take(self, positions: List[int]) -> "ReplacementMatrix":
+        """按位置取出若干行"""
+        return ReplacementMatrix(
+            row_indices=[self.row_indices[pos] for pos in positions],
+            columns=self._take_columns(positions),
+            filenames=[self.filenames[pos] for pos in positions]
+        )
+
+    def group_identical_rows(self) -> np.ndarray:
+        """
+        按替换值组合为各行分组：替换值完全相同的行生成的文档也完全相同
+
+        Returns:
+            每行的组号，按首次出现的顺序从0编号
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.intp)
+
+        # 同一列可能被多条规则共用，只取一次；各列的替换值已去重，直接按编码分组
+        columns = list({id(column): column for column in self.columns}.values())
+        if not columns:
+            return np.zeros(len(self), dtype=np.intp)
+
+        codes = np.column_stack([column.codes for column in columns])
+        _, first_pos, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+        rank = np.empty(len(first_pos), dtype=np.intp)
+        rank[np.argsort(first_pos)] = np.arange(len(first_pos))
+        return rank[inverse.ravel()]
+
+
+def factorize_column(excel_df: pd.DataFrame, col_name: str, row_indices: List[int]) -> Tuple[np.ndarray, list]:
+    """
+    按列取出所选行并编码为(编码, 唯一值)，后续处理只需对唯一值执行一次
+
+    行按DataFrame索引（数据行号）选取，只读取了部分行的数据也能使用原行号；
+    分类列直接使用已有的编码和类别；object列先逐个转为字符串再编码，与逐行str()的结果一致
+    """
+    series = excel_df[col_name].loc[row_indices]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        if not (codes < 0).any():
+            return codes, [str(value) for value in series.cat.categories]
+        series = series.astype(str)
+    elif series.dtype == object:
+        series = series.astype(str)
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return codes, list(uniques)
+
+
+def build_escaped_column(
+        excel_df: pd.DataFrame,
+        col_name: str,
+        row_indices: List[int],
+        wrap: Tuple[str, str]
+) -> EncodedColumn:
+    """生成一列转义后的替换值（列不存在时为空值）"""
+    left, right = wrap
+    if col_name not in excel_df.columns:
+        values = np.empty(1, dtype=object)
+        values[0] = escape_slot_value(f"{left}{right}")
+        return EncodedColumn(codes=np.zeros(len(row_indices), dtype=np.intp), values=values)
+
+    codes, uniques = factorize_column(excel_df, col_name, row_indices)
+    escaped = np.empty(len(uniques), dtype=object)
+    escaped[:] = [escape_slot_value(f"{left}{str(value).strip()}{right}") for value in uniques]
+
+    # 去空白后相同的值合并为同一个编码
+    remap, values = pd.factorize(escaped)
+    return EncodedColumn(codes=remap[codes], values=np.asarray(values, dtype=object))
+
+
+def build_batch_filenames(
+        excel_df: pd.DataFrame,
+        row_indices: List[int],
+        file_name_col: str,
+        file_prefix: str = "",
+        file_suffix: str = ""
+) -> List[str]:
+    """批量生成文件名（文件名列的每个唯一值只生成一次）"""
+    if not file_name_col or file_name_col not in excel_df.columns:
+        return [format_safe_filename("", file_prefix, file_suffix, row_idx) for row_idx in row_indices]
+
+    codes, uniques = factorize_column(excel_df, file_name_col, row_indices)
+    base_names = [clean_text(str(value)) for value in uniques]
+    named = {}
+
+    filenames = []
+    for code, row_idx in zip(codes, row_indices):
+        base_name = base_names[code]
+        if not base_name or base_name.isspace():
+            filenames.append(format_safe_filename("", file_prefix, file_suffix, row_idx))
+            continue
+        if code not in named:
+            named[code] = format_safe_filename(base_name, file_prefix, file_suffix, row_idx)
+        filenames.append(named[code])
+
+    return filenames
+
+
+def build_replacement_matrix(
+        replace_rules: List[Tuple[str, str]],
+        excel_df: pd.DataFrame,
+        row_indices: List[int],
+        replace_scope: str = "替换完整关键词",
+        file_name_col: str = "",
+        file_prefix: str = ""
+) -> ReplacementMatrix:
+    """
+    按列预计算所选行的全部替换值和文件名（单元格值去首尾空白，按替换范围保留括号）
+
+    Args:
+        replace_rules: 替换规则列表
+        excel_df: Excel数据
+        row_indices: 要处理的数据行号（DataFrame索引，从0开始）
+        replace_scope: 替换范围
+        file_name_col: 文件名列
+        file_prefix: 文件名前缀
+
+    Returns:
+        替换值矩阵
+    """
+    columns = []
+    column_cache = {}
+
+    for old_text, col_name in replace_rules:
+        cleaned_text = clean_text(old_text)
+        if not cleaned_text:
+            continue
+
+        wrap = get_bracket_wrap(cleaned_text, replace_scope)
+        cache_key = (col_name, wrap)
+        if cache_key not in column_cache:
+            column_cache[cache_key] = build_escaped_column(excel_df, col_name, row_indices, wrap)
+
+        columns.append(column_cache[cache_key])
+
+    return ReplacementMatrix(
+        row_indices=list(row_indices),
+        columns=columns,
+        filenames=build_batch_filenames(excel_df, row_indices, file_name_col, file_prefix)
+    )
+
+
+# ==================== 批量执行 ====================
+
+@dataclass
+class BatchTask:
+    """批量替换任务参数（每个工作进程只传递一次）"""
+    compiled: Optional[CompiledTemplate]
+    replace_rules: List[Tuple[str, str]]
+    replace_scope: str
+    file_name_col: str = ""
+    file_prefix: str = ""
+    result_dir: str = ""
+    merge_only: bool = False
+    merge_layout: Optional[MergeLayout] = None
+
+
+def generate_merged_fragment(task: BatchTask, values: List[bytes], filename: str, row_idx: int) -> ReplacedFile:
+    """直接合并模式：只渲染单行数据对应的正文片段，不生成独立文件"""
+    try:
+        fragment = render_slots(task.merge_layout.segments, task.merge_layout.slots, values)
+        replace_log, replace_cnt = task.compiled.replace_log, task.compiled.total_replace
+    except Exception as e:
+        fragment, replace_log, replace_cnt = b"", "❌ 失败", 0
+
+    return ReplacedFile(
+        filename=filename,
+        row_idx=row_idx,
+        log=replace_log,
+        replace_count=replace_cnt,
+        size=len(fragment),
+        merged=True,
+        fragment=fragment
+    )
+
+
+def generate_replaced_file(task: BatchTask, values: List[bytes], filename: str, row_idx: int) -> ReplacedFile:
+    """
+    生成单行数据对应的替换结果，文件内容写入结果目录
+
+    Args:
+        task: 批量任务参数
+        values: 该行转义后的替换值（来自替换值矩阵）
+        filename: 该行的文件名
+        row_idx: 行下标
+    """
+    if task.merge_layout is not None:
+        return generate_merged_fragment(task, values, filename, row_idx)
+
+    try:
+        data = render_compiled_values(task.compiled, values).getvalue()
+        replace_log, replace_cnt = task.compiled.replace_log, task.compiled.total_replace
+    except Exception as e:
+        data, replace_log, replace_cnt = b"", "❌ 失败", 0
+
+    path, size, file_hash = "", 0, ""
+    if data:
+        path, size, file_hash = ResultStore(task.result_dir).save(row_idx, data)
+
+    return ReplacedFile(
+        filename=filename,
+        row_idx=row_idx,
+        log=replace_log,
+        replace_count=replace_cnt,
+        path=path,
+        size=size,
+        file_hash=file_hash
+    )
+
+
+# 工作进程内的任务参数（由进程池初始化函数设置）
+_worker_task: Optional[BatchTask] = None
+
+
+def _init_batch_worker(task: BatchTask):
+    """工作进程初始化：保存编译后的模板和规则，之后只接收数据块"""
+    global _worker_task, _render_cache
+    _worker_task = task
+    # 每个工作进程使用自己的渲染缓存，不沿用父进程中的缓存和锁
+    _render_cache = RenderCache()
+
+
+def _run_batch_chunk(chunk: ReplacementMatrix) -> List[ReplacedFile]:
+    """在工作进程中处理一个数据块"""
+    return [
+        generate_replaced_file(_worker_task, chunk.row_values(pos), chunk.filenames[pos], row_idx)
+        for pos, row_idx in enumerate(chunk.row_indices)
+    ]
+
+
+def share_identical_results(
+        matrix: ReplacementMatrix,
+        groups: np.ndarray,
+        generated: Iterator[ReplacedFile]
+) -> Iterator[ReplacedFile]:
+    """
+    把每组生成一次的结果按行顺序分发给组内各行
+
+    每组第一行从generated中按顺序取出结果，其余行复用同一个结果文件（或合并片段），
+    只替换文件名和行号；组内最后一行分发后即释放缓存的结果。
+
+    Args:
+        matrix: 全部所选行的替换值矩阵
+        groups: 每行的组号（按首次出现顺序编号）
+        generated: 每组第一行的生成结果，按组号顺序
+    """
+    group_list = groups.tolist()
+    last_pos = {group: pos for pos, group in enumerate(group_list)}
+    shared = {}
+    next_group = 0
+
+    for pos, group in enumerate(group_list):
+        if group == next_group:
+            replaced = next(generated)
+            next_group += 1
+            if last_pos[group] > pos:
+                shared[group] = (replaced, replaced.fragment)
+            yield replaced
+            continue
+
+        source, fragment = shared[group] if last_pos[group] > pos else shared.pop(group)
+        yield replace(
+            source,
+            filename=matrix.filenames[pos],
+            row_idx=matrix.row_indices[pos],
+            fragment=fragment
+        )
+
+
+def get_batch_mp_context():
+    """
+    获取进程池的启动方式
+
+    只在主线程中使用fork（工作进程无需重新导入模块）。后台任务线程所在的进程还有
+    其他线程，fork时其他线程持有的锁会在子进程中永远处于锁定状态，因此改用
+    forkserver（预先导入本模块，之后由单线程的服务进程fork）或spawn。
+    """
+    start_methods = multiprocessing.get_all_start_methods()
+    if "fork" in start_methods and threading.current_thread() is threading.main_thread():
+        return multiprocessing.get_context("fork")
+    if "forkserver" in start_methods:
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def run_batch(
+        task: BatchTask,
+        excel_df: pd.DataFrame,
+        row_indices: List[int],
+        workers: int = 1,
+        chunk_size: int = DEFAULT_BATCH_CHUNK_SIZE
+) -> Iterator[ReplacedFile]:
+    """
+    执行批量替换，按行顺序逐个返回结果
+
+    先按列预计算所选行的替换值矩阵，逐行只做取值和拼接；替换值完全相同的
+    行只生成一次，其余行共用同一个结果文件。workers为1时在当前线程串行执行；
+    否则使用进程池，编译后的模板和规则每个工作进程只传递一次，矩阵按块分发，
+    结果按原顺序返回。
+
+    Args:
+        task: 批量任务参数
+        excel_df: Excel数据
+        row_indices: 要处理的数据行号（DataFrame索引，从0开始）
+        workers: 工作进程数
+        chunk_size: 每个数据块的行数
+
+    Returns:
+        ReplacedFile迭代器
+    """
+    matrix = build_replacement_matrix(
+        task.replace_rules, excel_df, row_indices, task.replace_scope, task.file_name_col, task.file_prefix
+    )
+
+    # 每组相同替换值只生成第一行
+    groups = matrix.group_identical_rows()
+    _, first_pos = np.unique(groups, return_index=True)
+    unique = matrix.take(first_pos.tolist())
+
+    chunk_size = max(1, int(chunk_size))
+    chunk_count = (len(unique) + chunk_size - 1) // chunk_size
+    workers = min(max(1, int(workers)), chunk_count)
+
+    if workers <= 1:
+        generated = (
+            generate_replaced_file(task, unique.row_values(pos), unique.filenames[pos], row_idx)
+            for pos, row_idx in enumerate(unique.row_indices)
+        )
+        yield from share_identical_results(matrix, groups, generated)
+        return
+
+    chunks = [unique.slice(start, start + chunk_size) for start in range(0, len(unique), chunk_size)]
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_batch_mp_context(),
+        initializer=_init_batch_worker,
+        initargs=(task,)
+    )
+    try:
+        generated = itertools.chain.from_iterable(executor.map(_run_batch_chunk, chunks))
+        yield from share_identical_results(matrix, groups, generated)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ==================== 后台任务 ====================
+
+@dataclass
+class BatchJob:
+    """后台批量替换任务（状态、进度计数和结果）"""
+    job_id: str
+    total: int
+    params: Dict = field(default_factory=dict)
+    meta: Dict = field(default_factory=dict)
+    state: str = "pending"
+    processed: int = 0
+    result_dir: str = ""
+    merged_path: str = ""
+    results: List[ReplacedFile] = field(default_factory=list)
+    log: List[str] = field(default_factory=list)
+    error: str = ""
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def is_finished(self) -> bool:
+        """任务是否已结束（完成、失败或取消）"""
+        return self.state in ("done", "failed", "cancelled")
+
+    @property
+    def progress(self) -> float:
+        """任务进度（0~1）"""
+        return self.processed / self.total if self.total > 0 else 0.0
+
+
+class JobManager:
+    """
+    管理后台批量任务
+
+    任务在独立线程中执行，不依赖触发它的页面脚本，因此页面重跑、刷新或
+    断线都不会中断任务；页面只需按任务ID轮询进度并在结束后取回结果。
+    """
+
+    def __init__(self, results_dir: str, max_finished_jobs: int = MAX_FINISHED_JOBS):
+        """
+        初始化任务管理器
+
+        Args:
+            results_dir: 结果存储根目录，每个任务在其中使用独立子目录
+            max_finished_jobs: 保留的已结束任务数
+        """
+        self.results_dir = results_dir
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs: Dict[str, BatchJob] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        ResultStore.cleanup_expired(self.results_dir)
+
+    def submit(
+            self,
+            template_bytes: bytes,
+            task: BatchTask,
+            excel_df: pd.DataFrame,
+            row_indices: List[int],
+            workers: int = 1,
+            chunk_size: int = DEFAULT_BATCH_CHUNK_SIZE,
+            params: Optional[Dict] = None,
+            meta: Optional[Dict] = None
+    ) -> BatchJob:
+        """
+        提交批量任务并立即返回
+
+        Args:
+            template_bytes: Word模板内容（在任务线程中编译）
+            task: 批量任务参数，compiled字段可为空
+            excel_df: Excel数据
+            row_indices: 要处理的行下标
+            workers: 工作进程数
+            chunk_size: 每个数据块的行数
+            params: 替换参数快照（用于判断结果是否过期）
+            meta: 附加信息（文件名等，用于历史记录）
+
+        Returns:
+            新建的任务
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = BatchJob(
+            job_id=job_id,
+            total=len(row_indices),
+            params=params or {},
+            meta=meta or {},
+            result_dir=ResultStore(os.path.join(self.results_dir, job_id)).job_dir
+        )
+        task.result_dir = job.result_dir
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+
+        thread = threading.Thread(
+            target=self._run,
+            args=(job, template_bytes, task, excel_df, row_indices, workers, chunk_size),
+            name=f"batch-job-{job.job_id}",
+            daemon=True
+        )
+        thread.start()
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        """按任务ID获取任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消任务（当前数据块处理完后停止）"""
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def _run(
+            self,
+            job: BatchJob,
+            template_bytes: bytes,
+            task: BatchTask,
+            excel_df: pd.DataFrame,
+            row_indices: List[int],
+            workers: int,
+            chunk_size: int
+    ):
+        """在任务线程中执行批量替换"""
+        job.state = "running"
+        results = None
+        writer = None
+        try:
+            if task.compiled is None:
+                task.compiled = compile_word_template(template_bytes, task.replace_rules)
+
+            # 直接合并模式：各行正文按顺序写入同一个合并文档
+            if task.merge_only:
+                task.merge_layout = build_merge_layout(task.compiled)
+                part_values = None
+                if task.compiled.parts and row_indices:
+                    part_values = build_replacement_matrix(
+                        task.replace_rules, excel_df, row_indices[:1], task.replace_scope
+                    ).row_values(0)
+                writer = MergedDocumentWriter(
+                    task.compiled, task.merge_layout, os.path.join(job.result_dir, "merged.docx"), part_values
+                )
+
+            results = run_batch(task, excel_df, row_indices, workers=workers, chunk_size=chunk_size)
+            for replaced in results:
+                if writer is not None and replaced.is_success:
+                    writer.append(replaced.fragment)
+                    replaced.fragment = b""
+
+                job.results.append(replaced)
+                job.log.append(f"【{replaced.row_idx + 1}】{replaced.log}")
+                job.processed += 1
+
+                if job.cancel_event.is_set():
+                    final_state = "cancelled"
+                    break
+            else:
+                final_state = "done"
+
+            # 合并文档写完后再标记任务结束，页面取回结果时文件已就绪
+            if writer is not None:
+                job.merged_path = writer.close()
+                writer = None
+
+            job.state = final_state
+
+        except Exception as e:
+            job.error = str(e)[:100]
+            job.state = "failed"
+        finally:
+            if results is not None:
+                results.close()
+            if writer is not None:
+                writer.abort()
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """
+        只保留最近的若干个已结束任务（调用方持有锁）
+
+        任务管理器由所有会话共享，移出的任务结果可能仍被取回过结果的会话引用，
+        因此这里只移除任务记录，结果目录由cleanup_expired按保留时间清理。
+        """
+        finished = [job for job in self._jobs.values() if job.is_finished]
+        finished.sort(key=lambda job: job.finished_at or 0)
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job.job_id]
+
+        ResultStore.cleanup_expired(self.results_dir, keep_ids=set(self._jobs))
+
+
+# ==================== 结果导出 ====================
+
+def write_results_zip(replaced_files: List[ReplacedFile], output) -> int:
+    """
+    流式写出结果压缩包
+
+    逐个成员从结果存储中分块读取并压缩写入，任何时候只有一个数据块在内存中；
+    超过4GB或65535个成员时自动使用ZIP64格式。
+
+    Args:
+        replaced_files: 要导出的结果文件（只导出成功生成的文件）
+        output: 可写、可定位的二进制文件对象
+
+    Returns:
+        写入的成员数
+    """
+    count = 0
+    date_time = time.localtime(time.time())[:6]
+
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+        for file in replaced_files:
+            if not file.is_valid:
+                continue
+
+            member_info = zipfile.ZipInfo(file.filename, date_time)
+            member_info.compress_type = zipfile.ZIP_DEFLATED
+            member_info.external_attr = 0o644 << 16
+
+            with file.open() as source, \
+                    zipf.open(member_info, 'w', force_zip64=file.size >= zipfile.ZIP64_LIMIT) as target:
+                shutil.copyfileobj(source, target, EXPORT_CHUNK_SIZE)
+            count += 1
+
+    return count
+
+
+def export_results_zip(replaced_files: List[ReplacedFile], export_path: str) -> str:
+    """
+    把结果压缩包写入磁盘文件（先写临时文件再替换，避免下载到半成品）
+
+    Returns:
+        压缩包路径
+    """
+    export_dir = os.path.dirname(export_path)
+    os.makedirs(export_dir, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=export_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            write_results_zip(replaced_files, output)
+        os.replace(temp_path, export_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return export_path
+
+
+# ==================== 文档合并 ====================
+
+def get_rels_name(part_name: str) -> str:
+    """部件对应的关系文件名，如 word/document.xml -> word/_rels/document.xml.rels"""
+    directory, filename = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", f"{filename}.rels")
+
+
+def resolve_rel_target(part_name: str, target: str) -> str:
+    """把关系中的相对目标解析为包内部件名"""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(part_name), target))
+
+
+def get_main_document_name(package: zipfile.ZipFile) -> str:
+    """从包关系中查找主文档部件名"""
+    try:
+        rels = etree.fromstring(package.read("_rels/.rels"))
+        for rel in rels:
+            if rel.get("Type") == REL_TYPE_DOCUMENT:
+                return resolve_rel_target("", rel.get("Target"))
+    except KeyError:
+        pass
+    return "word/document.xml"
+
+
+class DocxMerger:
+    """
+    流式合并docx文档
+
+    以第一个文档为基础，依次把每个文档的正文片段写入临时文件，最后拼成
+    合并后的document.xml。每次只解析一个源文档；正文引用的图片等部件按
+    部件名、CRC和大小比对，与基础文档相同的直接复用，不同的复制为新部件并改写关系ID；
+    编号定义不同时追加新的编号定义并改写numId。样式以基础文档为准。
+    """
+
+    def __init__(self, base_path: str, output_zip: zipfile.ZipFile, body_file):
+        """
+        读取基础文档的包结构
+
+        Args:
+            base_path: 基础文档路径
+            output_zip: 输出压缩包（新增部件直接写入）
+            body_file: 存放正文片段的临时文件
+        """
+        self.base_path = base_path
+        self.output_zip = output_zip
+        self.body_file = body_file
+        self.document_count = 0
+
+        with zipfile.ZipFile(base_path) as base_zip:
+            self.base_names = set(base_zip.namelist())
+            self.document_name = get_main_document_name(base_zip)
+            self.rels_name = get_rels_name(self.document_name)
+
+            document_root = etree.fromstring(base_zip.read(self.document_name))
+            body = document_root.find(qn("w:body"))
+            self.sect_pr = b""
+            if len(body) and body[-1].tag == qn("w:sectPr"):
+                self.sect_pr = etree.tostring(body[-1])
+            for child in list(body):
+                body.remove(child)
+            body.append(etree.Comment(MERGE_BODY_MARK[4:-3].decode()))
+            document_xml = etree.tostring(document_root, xml_declaration=True, encoding="UTF-8", standalone=True)
+            self.prefix, self.suffix = document_xml.split(MERGE_BODY_MARK)
+
+            self.rels_root = etree.fromstring(base_zip.read(self.rels_name)) \
+                if self.rels_name in self.base_names else etree.Element(f"{{{PKG_REL_NS}}}Relationships")
+            self.content_types = etree.fromstring(base_zip.read("[Content_Types].xml"))
+
+            # 基础文档关系索引：(类型, 部件名, CRC, 大小) 或 (类型, 外部地址, External, 0) -> 关系ID
+            self.rel_index: Dict[Tuple[str, str, object, int], str] = {}
+            self.numbering_name = ""
+            for rel in self.rels_root:
+                key = self._rel_key(base_zip, self.document_name, rel)
+                if key is not None:
+                    self.rel_index.setdefault(key, rel.get("Id"))
+                if rel.get("Type") == REL_TYPE_NUMBERING and rel.get("TargetMode") != "External":
+                    self.numbering_name = resolve_rel_target(self.document_name, rel.get("Target"))
+
+            self.numbering_hash = ""
+            self.numbering_root = None
+            if self.numbering_name in self.base_names:
+                self.numbering_hash = hashlib.md5(base_zip.read(self.numbering_name)).hexdigest()
+
+        self.rel_ids = {rel.get("Id") for rel in self.rels_root}
+        self.added_names = set()
+        self.rels_changed = False
+        self.content_types_changed = False
+
+    @staticmethod
+    def _rel_key(package: zipfile.ZipFile, part_name: str, rel) -> Optional[Tuple[str, str, object, int]]:
+        """
+        关系的比对键：外部关系按地址比对，内部部件按部件名、CRC和大小比对
+
+        CRC和大小取自压缩包目录，不需要读取和解压部件内容；各文档由同一模板生成，
+        同名部件CRC和大小都相同即视为内容相同。
+        """
+        if rel.get("TargetMode") == "External":
+            return rel.get("Type"), rel.get("Target"), "External", 0
+        target_name = resolve_rel_target(part_name, rel.get("Target"))
+        try:
+            info = package.getinfo(target_name)
+        except KeyError:
+            return None
+        return rel.get("Type"), target_name, info.CRC, info.file_size
+
+    def _new_rel_id(self) -> str:
+        """生成不冲突的关系ID"""
+        index = len(self.rel_ids) + 1
+        while f"rIdM{index}" in self.rel_ids:
+            index += 1
+        rel_id = f"rIdM{index}"
+        self.rel_ids.add(rel_id)
+        return rel_id
+
+    def _new_part_name(self, part_name: str) -> str:
+        """生成不冲突的部件名（同目录，改文件名）"""
+        stem, ext = posixpath.splitext(part_name)
+        index = 1
+        while f"{stem}_m{index}{ext}" in self.base_names or f"{stem}_m{index}{ext}" in self.added_names:
+            index += 1
+        new_name = f"{stem}_m{index}{ext}"
+        self.added_names.add(new_name)
+        return new_name
+
+    def _copy_content_type(self, source_types, part_name: str, new_name: str):
+        """为复制的新部件补充内容类型声明"""
+        for item in source_types:
+            if item.tag == f"{{{CONTENT_TYPES_NS}}}Override" and item.get("PartName") == f"/{part_name}":
+                override = etree.SubElement(self.content_types, f"{{{CONTENT_TYPES_NS}}}Override")
+                override.set("PartName", f"/{new_name}")
+                override.set("ContentType", item.get("ContentType"))
+                self.content_types_changed = True
+                return
+
+        ext = posixpath.splitext(new_name)[1].lstrip(".").lower()
+        defaults = {item.get("Extension", "").lower() for item in self.content_types
+                    if item.tag == f"{{{CONTENT_TYPES_NS}}}Default"}
+        if ext in defaults:
+            return
+        for item in source_types:
+            if item.tag == f"{{{CONTENT_TYPES_NS}}}Default" and item.get("Extension", "").lower() == ext:
+                default = etree.SubElement(self.content_types, f"{{{CONTENT_TYPES_NS}}}Default")
+                default.set("Extension", item.get("Extension"))
+                default.set("ContentType", item.get("ContentType"))
+                self.content_types_changed = True
+                return
+
+    def _map_relationships(self, source: zipfile.ZipFile, document_name: str, used_ids: set) -> Dict[str, str]:
+        """把源文档正文引用的关系映射到输出文档，必要时复制部件"""
+        rels_name = get_rels_name(document_name)
+        if not used_ids or rels_name not in source.namelist():
+            return {}
+
+        mapping = {}
+        source_types = None
+        for rel in etree.fromstring(source.read(rels_name)):
+            rel_id = rel.get("Id")
+            if rel_id not in used_ids:
+                continue
+
+            key = self._rel_key(source, document_name, rel)
+            if key is None:
+                continue
+            if key in self.rel_index:
+                mapping[rel_id] = self.rel_index[key]
+                continue
+
+            new_rel = etree.SubElement(self.rels_root, f"{{{PKG_REL_NS}}}Relationship")
+            new_rel.set("Id", self._new_rel_id())
+            new_rel.set("Type", rel.get("Type"))
+
+            if rel.get("TargetMode") == "External":
+                new_rel.set("Target", rel.get("Target"))
+                new_rel.set("TargetMode", "External")
+            else:
+                part_name = resolve_rel_target(document_name, rel.get("Target"))
+                new_name = self._new_part_name(part_name)
+                self.output_zip.writestr(new_name, source.read(part_name))
+
+                part_rels = get_rels_name(part_name)
+                if part_rels in source.namelist():
+                    self.output_zip.writestr(get_rels_name(new_name), source.read(part_rels))
+
+                if source_types is None:
+                    source_types = etree.fromstring(source.read("[Content_Types].xml"))
+                self._copy_content_type(source_types, part_name, new_name)
+                new_rel.set("Target", posixpath.relpath(new_name, posixpath.dirname(document_name)))
+
+            self.rels_changed = True
+            self.rel_index[key] = new_rel.get("Id")
+            mapping[rel_id] = new_rel.get("Id")
+
+        return mapping
+
+    def _map_numbering(self, source: zipfile.ZipFile, document_name: str) -> Dict[str, str]:
+        """编号定义与基础文档不同时追加为新的编号，返回numId映射"""
+        if not self.numbering_name:
+            return {}
+
+        rels_name = get_rels_name(document_name)
+        if rels_name not in source.namelist():
+            return {}
+
+        numbering_name = ""
+        for rel in etree.fromstring(source.read(rels_name)):
+            if rel.get("Type") == REL_TYPE_NUMBERING and rel.get("TargetMode") != "External":
+                numbering_name = resolve_rel_target(document_name, rel.get("Target"))
+        if not numbering_name or numbering_name not in source.namelist():
+            return {}
+
+        numbering_data = source.read(numbering_name)
+        if hashlib.md5(numbering_data).hexdigest() == self.numbering_hash:
+            return {}
+
+        if self.numbering_root is None:
+            with zipfile.ZipFile(self.base_path) as base_zip:
+                self.numbering_root = etree.fromstring(base_zip.read(self.numbering_name))
+
+        root = self.numbering_root
+        abstract_ids = [int(el.get(qn("w:abstractNumId"))) for el in root.iter(qn("w:abstractNum"))]
+        num_ids = [int(el.get(qn("w:numId"))) for el in root.iter(qn("w:num"))]
+        next_abstract = max(abstract_ids, default=-1) + 1
+        next_num = max(num_ids, default=0) + 1
+
+        abstract_map = {}
+        last_abstract = None
+        for el in root.iter(qn("w:abstractNum")):
+            last_abstract = el
+
+        source_root = etree.fromstring(numbering_data)
+        for el in source_root.findall(qn("w:abstractNum")):
+            abstract_map[el.get(qn("w:abstractNumId"))] = str(next_abstract)
+            el.set(qn("w:abstractNumId"), str(next_abstract))
+            next_abstract += 1
+            if last_abstract is not None:
+                last_abstract.addnext(el)
+            else:
+                root.insert(0, el)
+            last_abstract = el
+
+        num_map = {}
+        for el in source_root.findall(qn("w:num")):
+            num_map[el.get(qn("w:numId"))] = str(next_num)
+            el.set(qn("w:numId"), str(next_num))
+            next_num += 1
+            abstract_ref = el.find(qn("w:abstractNumId"))
+            if abstract_ref is not None:
+                abstract_ref.set(qn("w:val"), abstract_map.get(abstract_ref.get(qn("w:val")), abstract_ref.get(qn("w:val"))))
+            root.append(el)
+
+        return num_map
+
+    def append(self, path: str):
+        """追加一个文档的正文（第一个文档之后的每个文档前插入分页段落）"""
+        with zipfile.ZipFile(path) as source:
+            document_name = get_main_document_name(source)
+            body = etree.fromstring(source.read(document_name)).find(qn("w:body"))
+            children = [child for child in body if child.tag != qn("w:sectPr")]
+
+            chunks = []
+            if self.document_count > 0:
+                used_ids = set()
+                has_numbering = False
+                for child in children:
+                    for el in child.iter():
+                        if el.tag == qn("w:numId"):
+                            has_numbering = True
+                        for attr, value in el.attrib.items():
+                            if attr.startswith(f"{{{REL_NS}}}"):
+                                used_ids.add(value)
+
+                rel_map = self._map_relationships(source, document_name, used_ids)
+                num_map = self._map_numbering(source, document_name) if has_numbering else {}
+
+                if rel_map or num_map:
+                    for child in children:
+                        for el in child.iter():
+                            if num_map and el.tag == qn("w:numId") and el.get(qn("w:val")) in num_map:
+                                el.set(qn("w:val"), num_map[el.get(qn("w:val"))])
+                            for attr, value in el.attrib.items():
+                                if value in rel_map and attr.startswith(f"{{{REL_NS}}}"):
+                                    el.set(attr, rel_map[value])
+
+                chunks.append(MERGE_PAGE_BREAK)
+
+            chunks.extend(etree.tostring(child, with_tail=False) for child in children)
+
+        self.body_file.write(b"".join(chunks))
+        self.document_count += 1
+
+    def finish(self):
+        """写出合并后的document.xml和基础文档的其余部件"""
+        with self.output_zip.open(self.document_name, 'w', force_zip64=True) as target:
+            target.write(self.prefix)
+            self.body_file.seek(0)
+            shutil.copyfileobj(self.body_file, target, EXPORT_CHUNK_SIZE)
+            target.write(self.sect_pr)
+            target.write(self.suffix)
+
+        replaced_parts = {}
+        if self.rels_changed:
+            replaced_parts[self.rels_name] = etree.tostring(
+                self.rels_root, xml_declaration=True, encoding="UTF-8", standalone=True)
+        if self.content_types_changed:
+            replaced_parts["[Content_Types].xml"] = etree.tostring(
+                self.content_types, xml_declaration=True, encoding="UTF-8", standalone=True)
+        if self.numbering_root is not None:
+            replaced_parts[self.numbering_name] = etree.tostring(
+                self.numbering_root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+        with zipfile.ZipFile(self.base_path) as base_zip:
+            for info in base_zip.infolist():
+                if info.filename == self.document_name:
+                    continue
+                data = replaced_parts.get(info.filename)
+                if data is None:
+                    data = base_zip.read(info)
+                self.output_zip.writestr(info.filename, data)
+
+
+def merge_word_documents(replaced_files: List[ReplacedFile], output_path: str) -> str:
+    """
+    合并多个Word文档为一个文档（每个文档之间分页）
+
+    正文逐个文档流式写入，任何时候只解析一个源文档；无法读取的文档会被跳过。
+
+    Args:
+        replaced_files: 要合并的结果文件
+        output_path: 合并结果的保存路径
+
+    Returns:
+        合并结果路径
+    """
+    valid_files = [file for file in replaced_files if file.is_valid]
+    if not valid_files:
+        raise ValueError("没有文件")
+
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix=".tmp")
+    os.close(fd)
+
+    try:
+        with tempfile.TemporaryFile(dir=output_dir) as body_file, \
+                zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as output_zip:
+            merger = DocxMerger(valid_files[0].path, output_zip, body_file)
+            merger.append(valid_files[0].path)
+
+            for file in valid_files[1:]:
+                try:
+                    merger.append(file.path)
+                except Exception:
+                    continue
+
+            merger.finish()
+
+        os.replace(temp_path, output_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return output_path
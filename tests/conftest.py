@@ -0,0 +1,10 @@
+"""
+测试公共设置：应用模块位于app目录，按应用运行时的方式直接导入
+"""
+
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
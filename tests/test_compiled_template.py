@@ -0,0 +1,158 @@
+"""
+compile_word_template / render_compiled_values：模板编译一次，逐行拼接替换值
+"""
+
+import io
+
+import pandas as pd
+import pytest
+from docx import Document
+from docx.oxml.ns import nsdecls, qn
+from docx.oxml.parser import parse_xml
+
+from replace_engine import build_replacement_matrix, compile_word_template, render_compiled_values
+
+RULES = [("【姓名】", "姓名"), ("【部门】", "部门"), ("【备注】", "备注")]
+
+
+@pytest.fixture(scope="module")
+def template_bytes():
+    doc = Document()
+    doc.core_properties.title = "【姓名】的合同"
+    doc.sections[0].header.paragraphs[0].text = "页眉：【部门】"
+    doc.add_paragraph("甲方：【姓名】，部门：【部门】")
+    paragraph = doc.add_paragraph("备注")
+    paragraph.add_run("【备").bold = True
+    paragraph.add_run("注】")
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 0).text = "姓名"
+    table.cell(0, 1).text = "【姓名】"
+    doc.add_paragraph("没有关键字的段落")
+
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+@pytest.fixture(scope="module")
+def excel_df():
+    return pd.DataFrame({
+        "姓名": ["张三", "A&B <C>"],
+        "部门": ["财务部", "第一行\n第二行"],
+        "备注": ["无", "x"],
+    })
+
+
+def render_row(compiled, excel_df, row_idx, replace_scope="替换完整关键词"):
+    matrix = build_replacement_matrix(RULES, excel_df, [row_idx], replace_scope)
+    return Document(render_compiled_values(compiled, matrix.row_values(0)))
+
+
+def test_compile_counts_every_keyword(template_bytes):
+    compiled = compile_word_template(template_bytes, RULES)
+
+    assert compiled.total_replace == 6
+    assert len(compiled.slots) > 0
+    assert "【姓名】" in compiled.replace_log
+
+
+def test_render_fills_body_table_header_and_properties(template_bytes, excel_df):
+    compiled = compile_word_template(template_bytes, RULES)
+    doc = render_row(compiled, excel_df, 0)
+
+    assert [p.text for p in doc.paragraphs] == ["甲方：张三，部门：财务部", "备注无", "没有关键字的段落"]
+    assert doc.tables[0].cell(0, 1).text == "张三"
+    assert doc.sections[0].header.paragraphs[0].text == "页眉：财务部"
+    assert doc.core_properties.title == "张三的合同"
+
+
+def test_render_keeps_format_of_run_where_keyword_starts(template_bytes, excel_df):
+    compiled = compile_word_template(template_bytes, RULES)
+    runs = render_row(compiled, excel_df, 0).paragraphs[1].runs
+
+    assert [(run.text, run.bold) for run in runs if run.text] == [("备注", None), ("无", True)]
+
+
+def test_render_escapes_xml_and_converts_line_breaks(template_bytes, excel_df):
+    compiled = compile_word_template(template_bytes, RULES)
+    doc = render_row(compiled, excel_df, 1)
+
+    assert doc.paragraphs[0].text == "甲方：A&B <C>，部门：第一行\n第二行"
+    assert doc.paragraphs[0]._p.xpath(".//w:br")
+    assert doc.core_properties.title == "A&B <C>的合同"
+
+
+def test_bracket_scope_keeps_brackets(template_bytes, excel_df):
+    compiled = compile_word_template(template_bytes, RULES)
+    doc = render_row(compiled, excel_df, 0, replace_scope="仅替换括号内内容")
+
+    assert doc.paragraphs[0].text == "甲方：【张三】，部门：【财务部】"
+    assert doc.paragraphs[1].text == "备注【无】"
+
+
+def test_render_is_repeatable(template_bytes, excel_df):
+    compiled = compile_word_template(template_bytes, RULES)
+    matrix = build_replacement_matrix(RULES, excel_df, [0, 1])
+
+    first = [render_compiled_values(compiled, matrix.row_values(pos)).getvalue() for pos in range(2)]
+    second = [render_compiled_values(compiled, matrix.row_values(pos)).getvalue() for pos in range(2)]
+
+    assert first == second
+    assert first[0] != first[1]
+
+
+def make_vml_text_box_run(text):
+    """生成包含VML文本框的run"""
+    return parse_xml(
+        f'<w:r {nsdecls("w")} xmlns:v="urn:schemas-microsoft-com:vml">'
+        f'<w:pict><v:shape><v:textbox><w:txbxContent><w:p><w:r><w:t>{text}</w:t></w:r></w:p>'
+        f'</w:txbxContent></v:textbox></v:shape></w:pict></w:r>'
+    )
+
+
+def test_text_box_after_split_keyword_is_replaced(excel_df):
+    doc = Document()
+    paragraph = doc.add_paragraph()
+    for text, rsid in (("【姓", "00A1"), ("名】", "00B2")):
+        paragraph.add_run(text)._r.set(qn("w:rsidR"), rsid)
+    paragraph._p.append(make_vml_text_box_run("框：【部门】"))
+    output = io.BytesIO()
+    doc.save(output)
+
+    compiled = compile_word_template(output.getvalue(), RULES)
+    rendered = render_row(compiled, excel_df, 0)
+
+    assert compiled.total_replace == 2
+    assert [p.text for p in rendered.element.body.iter(qn("w:p"))] == ["张三", "框：财务部"]
+
+
+def make_alternate_text_box_run(text):
+    """生成DrawingML文本框（mc:Choice）及其VML副本（mc:Fallback）"""
+    content = f"<w:txbxContent><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:txbxContent>"
+    return parse_xml(
+        f'<w:r {nsdecls("w", "wp", "a")}'
+        ' xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"'
+        ' xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"'
+        ' xmlns:v="urn:schemas-microsoft-com:vml">'
+        '<mc:AlternateContent><mc:Choice Requires="wps"><w:drawing><wp:anchor><a:graphic>'
+        f'<a:graphicData><wps:wsp><wps:txbx>{content}</wps:txbx></wps:wsp></a:graphicData>'
+        '</a:graphic></wp:anchor></w:drawing></mc:Choice>'
+        f'<mc:Fallback><w:pict><v:shape><v:textbox>{content}</v:textbox></v:shape></w:pict></mc:Fallback>'
+        '</mc:AlternateContent></w:r>'
+    )
+
+
+def test_text_box_fallback_copy_is_replaced_but_not_counted(excel_df):
+    doc = Document()
+    doc.add_paragraph()._p.append(make_alternate_text_box_run("框：【姓名】"))
+    doc.sections[0].header.paragraphs[0]._p.append(make_alternate_text_box_run("页眉框：【部门】"))
+    output = io.BytesIO()
+    doc.save(output)
+
+    compiled = compile_word_template(output.getvalue(), RULES)
+    rendered = render_row(compiled, excel_df, 0)
+
+    assert compiled.total_replace == 2
+    assert [p.text for p in rendered.element.body.iter(qn("w:p")) if p.text] == ["框：张三", "框：张三"]
+    header = rendered.sections[0].header._element
+    assert [p.text for p in header.iter(qn("w:p")) if p.text] == ["页眉框：财务部", "页眉框：财务部"]
@@ -0,0 +1,93 @@
+"""
+DocxMerger / merge_word_documents：流式合并，相同部件复用，不同部件复制并改写关系
+"""
+
+import io
+import zipfile
+
+import pytest
+from docx import Document
+from docx.oxml.ns import qn
+from PIL import Image
+
+from replace_engine import ReplacedFile, merge_word_documents
+
+
+def make_image(color):
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(output, format="PNG")
+    output.seek(0)
+    return output
+
+
+def make_docx(path, title, color=None):
+    doc = Document()
+    doc.add_paragraph(f"{title}-第一段")
+    if color is not None:
+        doc.add_picture(make_image(color))
+    doc.add_paragraph(f"{title}-第二段")
+    doc.save(path)
+    return ReplacedFile(filename=path.name, row_idx=0, log="", path=str(path), size=path.stat().st_size)
+
+
+def image_parts(package):
+    return sorted(name for name in package.namelist() if name.startswith("word/media/"))
+
+
+def embedded_images(path):
+    """按正文顺序返回每张图片引用的部件内容"""
+    doc = Document(path)
+    images = []
+    for blip in doc.element.body.iter(qn("a:blip")):
+        images.append(doc.part.related_parts[blip.get(qn("r:embed"))].blob)
+    return images
+
+
+def test_merge_keeps_document_order_with_page_breaks(tmp_path):
+    files = [make_docx(tmp_path / f"{name}.docx", name) for name in ("甲", "乙", "丙")]
+    output_path = merge_word_documents(files, str(tmp_path / "out" / "merged.docx"))
+
+    doc = Document(output_path)
+    texts = [p.text for p in doc.paragraphs if p.text]
+    assert texts == ["甲-第一段", "甲-第二段", "乙-第一段", "乙-第二段", "丙-第一段", "丙-第二段"]
+    assert len(doc.element.body.xpath("./w:p/w:pPr/w:pageBreakBefore")) == 2
+
+
+def test_identical_images_are_shared(tmp_path):
+    files = [make_docx(tmp_path / f"{index}.docx", str(index), "red") for index in range(3)]
+    output_path = merge_word_documents(files, str(tmp_path / "merged.docx"))
+
+    with zipfile.ZipFile(output_path) as package:
+        assert image_parts(package) == ["word/media/image1.png"]
+    images = embedded_images(output_path)
+    assert len(images) == 3 and len(set(images)) == 1
+
+
+def test_different_image_with_same_name_is_copied(tmp_path):
+    files = [
+        make_docx(tmp_path / "a.docx", "a", "red"),
+        make_docx(tmp_path / "b.docx", "b", "blue"),
+        make_docx(tmp_path / "c.docx", "c", "red"),
+    ]
+    output_path = merge_word_documents(files, str(tmp_path / "merged.docx"))
+
+    with zipfile.ZipFile(output_path) as package:
+        assert len(image_parts(package)) == 2
+        assert package.testzip() is None
+
+    red, blue = make_image("red").getvalue(), make_image("blue").getvalue()
+    assert embedded_images(output_path) == [red, blue, red]
+
+
+def test_invalid_files_are_skipped(tmp_path):
+    files = [
+        make_docx(tmp_path / "a.docx", "a"),
+        ReplacedFile(filename="missing.docx", row_idx=1, log="失败"),
+        make_docx(tmp_path / "b.docx", "b"),
+    ]
+    output_path = merge_word_documents(files, str(tmp_path / "merged.docx"))
+
+    assert [p.text for p in Document(output_path).paragraphs if p.text] == ["a-第一段", "a-第二段", "b-第一段", "b-第二段"]
+
+    with pytest.raises(ValueError):
+        merge_word_documents(files[1:2], str(tmp_path / "empty.docx"))
@@ -0,0 +1,92 @@
+"""
+scan_excel_sheet / read_excel_window：按需读取的结果与pandas.read_excel（全部按字符串读取）一致
+"""
+
+import datetime
+import io
+import random
+import warnings
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from excel_loader import read_excel_window, scan_excel_sheet
+
+CELL_VALUES = [
+    "文本", " 有空白 ", "1", 1, 0, 2, -3, 1.0, 0.0, 2.5, 1e20, True, False,
+    datetime.datetime(2024, 1, 31), datetime.datetime(2024, 1, 31, 8, 30), None,
+]
+
+
+def make_workbook(rows) -> bytes:
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def read_full(data: bytes) -> pd.DataFrame:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return pd.read_excel(io.BytesIO(data), dtype=str, keep_default_na=False)
+
+
+def assert_same(window: pd.DataFrame, expected: pd.DataFrame):
+    pd.testing.assert_frame_equal(window.astype(object), expected, check_index_type=False)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_preview_and_windows_match_read_excel(seed):
+    rng = random.Random(seed)
+    for _ in range(10):
+        width = rng.randint(1, 5)
+        rows = [[f"列{column}" for column in range(width)]]
+        for _ in range(rng.randint(1, 30)):
+            rows.append([rng.choice(CELL_VALUES) for _ in range(width)])
+        data = make_workbook(rows)
+        full = read_full(data)
+
+        outline = scan_excel_sheet(io.BytesIO(data), preview_rows=rng.randint(1, 5))
+        assert outline.columns == list(full.columns)
+        assert outline.row_count == len(full)
+        assert_same(outline.preview, full.head(len(outline.preview)))
+
+        for _ in range(3):
+            start = rng.randint(0, len(full))
+            stop = rng.randint(start, len(full))
+            columns = rng.sample(outline.columns, rng.randint(1, width))
+            for categorize in (False, True):
+                window = read_excel_window(io.BytesIO(data), outline, columns, start, stop, categorize=categorize)
+                assert_same(window, full.loc[start:stop - 1, list(dict.fromkeys(columns))])
+
+
+def test_true_and_one_use_first_spelling_of_whole_column():
+    data = make_workbook([["标记", "数量"], [1, False], [True, 0], [0, 1], [False, True]])
+    full = read_full(data)
+    outline = scan_excel_sheet(io.BytesIO(data), preview_rows=1)
+
+    assert list(full["标记"]) == ["1", "1", "0", "0"]
+    assert list(full["数量"]) == ["False", "False", "1", "1"]
+    assert_same(outline.preview, full.head(1))
+    assert_same(read_excel_window(io.BytesIO(data), outline, outline.columns, 2, 4), full.iloc[2:4])
+
+
+def test_blank_rows_and_trailing_empty_rows():
+    data = make_workbook([["甲", "乙"], ["a", None], [None, None], [None, "b"]])
+    full = read_full(data)
+    outline = scan_excel_sheet(io.BytesIO(data))
+
+    assert outline.row_count == len(full) == 3
+    assert_same(read_excel_window(io.BytesIO(data), outline, ["乙", "甲"]), full[["乙", "甲"]])
+
+
+def test_unknown_columns_are_ignored():
+    data = make_workbook([["甲"], ["a"]])
+    outline = scan_excel_sheet(io.BytesIO(data))
+
+    window = read_excel_window(io.BytesIO(data), outline, ["不存在", "甲"])
+    assert list(window.columns) == ["甲"]
@@ -0,0 +1,48 @@
+"""
+JobManager：任务管理器由所有会话共享，移出的任务不能删除会话仍在引用的结果文件
+"""
+
+import io
+import os
+import time
+
+import pandas as pd
+from docx import Document
+
+from replace_engine import BatchTask, JobManager
+
+RULES = [("【姓名】", "姓名")]
+
+
+def make_template() -> bytes:
+    doc = Document()
+    doc.add_paragraph("甲方：【姓名】")
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def wait_finished(job, timeout=30):
+    deadline = time.time() + timeout
+    while not job.is_finished:
+        assert time.time() < deadline, "任务超时"
+        time.sleep(0.05)
+
+
+def test_pruned_jobs_keep_their_result_files(tmp_path):
+    manager = JobManager(str(tmp_path), max_finished_jobs=1)
+    template_bytes = make_template()
+    excel_df = pd.DataFrame({"姓名": ["张三", "李四"]})
+
+    jobs = []
+    for _ in range(3):
+        job = manager.submit(template_bytes, BatchTask(None, RULES, "替换完整关键词"), excel_df, [0, 1])
+        wait_finished(job)
+        jobs.append(job)
+
+    assert manager.get(jobs[0].job_id) is None
+    assert manager.get(jobs[-1].job_id) is not None
+    for job in jobs:
+        assert job.state == "done"
+        assert [Document(file.path).paragraphs[0].text for file in job.results] == ["甲方：张三", "甲方：李四"]
+        assert all(os.path.exists(file.path) for file in job.results)
@@ -0,0 +1,74 @@
+"""
+KeywordMatcher：多关键字单遍匹配（最左优先、同起点最长优先、命中不重叠）
+"""
+
+import random
+
+import pytest
+
+from replace_engine import KeywordMatcher
+
+
+def reference_find_all(keywords, text):
+    """逐个位置尝试所有关键字的朴素实现，作为对照"""
+    first_index = {}
+    for idx, keyword in enumerate(keywords):
+        if keyword:
+            first_index.setdefault(keyword, idx)
+
+    hits = []
+    pos = 0
+    while pos < len(text):
+        candidates = [keyword for keyword in first_index if text.startswith(keyword, pos)]
+        if not candidates:
+            pos += 1
+            continue
+        keyword = max(candidates, key=len)
+        hits.append((pos, pos + len(keyword), first_index[keyword]))
+        pos += len(keyword)
+    return hits
+
+
+def test_finds_every_keyword_in_one_pass():
+    matcher = KeywordMatcher(["【姓名】", "【部门】"])
+    assert matcher.find_all("【姓名】在【部门】，【姓名】") == [(0, 4, 0), (5, 9, 1), (10, 14, 0)]
+
+
+def test_leftmost_match_wins_over_rule_order():
+    matcher = KeywordMatcher(["bc", "ab"])
+    assert matcher.find_all("abc") == [(0, 2, 1)]
+
+
+def test_longest_match_wins_at_same_start():
+    matcher = KeywordMatcher(["【姓名", "【姓名】"])
+    assert matcher.find_all("【姓名】") == [(0, 4, 1)]
+
+
+def test_hits_do_not_overlap():
+    matcher = KeywordMatcher(["aa"])
+    assert matcher.find_all("aaaaa") == [(0, 2, 0), (2, 4, 0)]
+
+
+def test_duplicate_keyword_uses_first_index_and_empty_is_ignored():
+    matcher = KeywordMatcher(["", "x", "x"])
+    assert matcher.find_all("xx") == [(0, 1, 1), (1, 2, 1)]
+
+
+def test_no_match():
+    assert KeywordMatcher(["【姓名】"]).find_all("姓名") == []
+    assert KeywordMatcher([]).find_all("abc") == []
+
+
+def test_from_patterns_uses_cleaned_keywords():
+    patterns = [(" 【姓名】 ", "姓名", "【姓名】", "张三")]
+    assert KeywordMatcher.from_patterns(patterns).find_all("甲方【姓名】") == [(2, 6, 0)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_naive_reference(seed):
+    rng = random.Random(seed)
+    alphabet = "ab【】c"
+    for _ in range(200):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 5))]
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert KeywordMatcher(keywords).find_all(text) == reference_find_all(keywords, text)
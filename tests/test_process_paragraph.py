@@ -0,0 +1,79 @@
+"""
+process_paragraph：段落内关键字替换，只改写命中所在的run
+"""
+
+from docx import Document
+from docx.oxml.ns import qn
+
+from replace_engine import process_paragraph
+
+
+def make_paragraph(*runs):
+    """按(文本, 是否加粗, rsid)生成段落"""
+    doc = Document()
+    paragraph = doc.add_paragraph()
+    for text, bold, rsid in runs:
+        run = paragraph.add_run(text)
+        run.bold = bold
+        if rsid:
+            run._r.set(qn("w:rsidR"), rsid)
+    return paragraph
+
+
+def patterns(*pairs):
+    return [(keyword, keyword.strip("【】"), keyword, value) for keyword, value in pairs]
+
+
+def test_replaces_keyword_and_counts_hits():
+    paragraph = make_paragraph(("【姓名】与【姓名】在【部门】", False, None))
+    count = process_paragraph(paragraph, patterns(("【姓名】", "张三"), ("【部门】", "财务部")))
+
+    assert paragraph.text == "张三与张三在财务部"
+    assert dict(count) == {("【姓名】", "姓名"): 2, ("【部门】", "部门"): 1}
+
+
+def test_keyword_split_across_runs_with_same_format_is_merged():
+    paragraph = make_paragraph(("甲方：【姓", False, "00A1"), ("名】", False, "00B2"), ("。", False, None))
+    count = process_paragraph(paragraph, patterns(("【姓名】", "张三")))
+
+    assert paragraph.text == "甲方：张三。"
+    assert dict(count) == {("【姓名】", "姓名"): 1}
+    assert [run.text for run in paragraph.runs] == ["甲方：张三", "。"]
+
+
+def test_keyword_split_across_formats_uses_first_run_format():
+    paragraph = make_paragraph(("前【姓", True, None), ("名】后", False, None))
+    process_paragraph(paragraph, patterns(("【姓名】", "张三")))
+
+    assert paragraph.text == "前张三后"
+    assert [(run.text, run.bold) for run in paragraph.runs] == [("前张三", True), ("后", False)]
+
+
+def test_untouched_runs_keep_their_properties():
+    paragraph = make_paragraph(("开头", True, "00C3"), ("【姓名】", False, None), ("结尾", True, "00D4"))
+    untouched = [paragraph.runs[0]._r, paragraph.runs[2]._r]
+    before = [(run.get(qn("w:rsidR")), run.find(qn("w:rPr")).xml) for run in untouched]
+
+    process_paragraph(paragraph, patterns(("【姓名】", "张三")))
+
+    assert paragraph.text == "开头张三结尾"
+    assert [(run.get(qn("w:rsidR")), run.find(qn("w:rPr")).xml) for run in untouched] == before
+    assert [run._r for run in paragraph.runs][::2] == untouched
+
+
+def test_replacement_keeps_surrounding_whitespace():
+    paragraph = make_paragraph(("【姓名】", False, None))
+    process_paragraph(paragraph, patterns(("【姓名】", " 张三 ")))
+
+    text_node = paragraph.runs[0]._r.find(qn("w:t"))
+    assert paragraph.text == " 张三 "
+    assert text_node.get(qn("xml:space")) == "preserve"
+
+
+def test_no_match_leaves_paragraph_unchanged():
+    paragraph = make_paragraph(("没有关键字", False, "00E5"))
+    before = paragraph._p.xml
+
+    assert not process_paragraph(paragraph, patterns(("【姓名】", "张三")))
+    assert not process_paragraph(paragraph, [])
+    assert paragraph._p.xml == before